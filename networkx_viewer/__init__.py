@@ -2,6 +2,7 @@ __version__ = '0.3.1'
 
 
 from .graph_canvas import GraphCanvas
+from .coordinate_map import CoordinateMap
 from .tokens import (NodeToken, EdgeToken, TkPassthroughNodeToken,
                     TkPassthroughEdgeToken)
 from .viewer import ViewerApp, TkPassthroughViewerApp
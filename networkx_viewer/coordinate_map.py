@@ -0,0 +1,107 @@
+"""
+Precomputed positions for every node of a large data graph, so the viewer
+can place nodes by looking them up instead of running a layout.
+"""
+import os
+import pickle
+
+import networkx as nx
+
+
+class CoordinateMap(object):
+    """Positions of all the nodes of a data graph, computed once (offline)
+    with compute and saved with save.  Positions are stored as an (N, 2)
+    array in a NumPy .npy file which load memory-maps, so opening even a
+    very large map is quick.  The node ids, in row order, are pickled next
+    to it in <path>.nodes.
+
+    Typical use:
+        >>> CoordinateMap.compute(G).save('coords.npy')    # Once, offline
+        >>> Viewer(G, coordinate_map='coords.npy')
+    """
+
+    def __init__(self, nodes, positions):
+        import numpy as np
+
+        self.nodes = list(nodes)
+        self.positions = positions
+        if positions.shape != (len(self.nodes), 2):
+            raise ValueError("Need one (x, y) position per node, got an "
+                             "array of shape %s for %d nodes"
+                             % (positions.shape, len(self.nodes)))
+        self._index = dict(zip(self.nodes, range(len(self.nodes))))
+
+        # Typical distance between neighboring nodes, used to pick a
+        #  scale when there is nothing on the canvas to align to
+        lo = np.asarray(positions.min(axis=0))
+        hi = np.asarray(positions.max(axis=0))
+        area = float(np.prod(np.maximum(hi - lo, 1e-12)))
+        self.spacing = (area / max(len(self.nodes), 1))**.5
+
+    @classmethod
+    def compute(cls, G, scale=1.0, seed=None, iterations=50):
+        """Lay out all of G with the multilevel engine (which handles
+        graphs of hundreds of thousands of nodes) and return the map."""
+        import numpy as np
+        from networkx_viewer.graph_canvas import GraphCanvas
+
+        nodes = list(G)
+        if len(nodes) == 0:
+            return cls(nodes, np.zeros((0, 2)))
+        if len(nodes) == 1:
+            return cls(nodes, np.zeros((1, 2)))
+        A = nx.adjacency_matrix(G, nodelist=nodes)
+        pos = GraphCanvas._multilevel(A, iterations=iterations,
+                                      rng=np.random.RandomState(seed))
+        pos = nx.layout.rescale_layout(pos, scale=scale)
+        return cls(nodes, pos)
+
+    @classmethod
+    def load(cls, path, G=None, mmap_mode='r'):
+        """Open a map saved with save.  If path has no .nodes file next to
+        it, the rows are taken to be in the order of the nodes of G."""
+        import numpy as np
+
+        positions = np.load(path, mmap_mode=mmap_mode)
+        if os.path.exists(path + '.nodes'):
+            with open(path + '.nodes', 'rb') as f:
+                nodes = pickle.load(f)
+        elif G is not None:
+            nodes = list(G)
+        else:
+            raise ValueError("No node list saved with %s; pass the graph "
+                             "the positions were computed for" % path)
+        return cls(nodes, positions)
+
+    def save(self, path):
+        """Save positions to path (a .npy file) and the node ids to
+        <path>.nodes"""
+        import numpy as np
+
+        with open(path, 'wb') as f:
+            np.save(f, np.asarray(self.positions, dtype='float64'))
+        with open(path + '.nodes', 'wb') as f:
+            pickle.dump(self.nodes, f, pickle.HIGHEST_PROTOCOL)
+
+    def lookup(self, nodes):
+        """Return (positions, found) for a list of nodes.  found is a
+        boolean mask of the nodes which are in the map; rows of positions
+        for the others are nan."""
+        import numpy as np
+
+        rows = np.fromiter((self._index.get(n, -1) for n in nodes),
+                           dtype=np.intp, count=len(nodes))
+        found = rows >= 0
+        ans = np.full((len(nodes), 2), np.nan)
+        # Only the looked up rows of a memory-mapped map are read from disk
+        ans[found] = self.positions[rows[found]]
+        return ans, found
+
+    def __contains__(self, node):
+        return node in self._index
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, node):
+        return self.positions[self._index[node]]
@@ -9,22 +9,37 @@ Released under the GNU General Public License (GPL)
 """
 from math import atan2, pi, cos, sin
 import collections
+import itertools
+import multiprocessing
+import os
 import pickle
+import tempfile
+import threading
+import time
 try:
     # Python 3
     import tkinter as tk
     import tkinter.messagebox as tkm
     import tkinter.simpledialog as tkd
+    import queue
 except ImportError:
     # Python 2
     import Tkinter as tk
     import tkMessageBox as tkm
     import tkSimpleDialog as tkd
+    import Queue as queue
 
 import networkx as nx
 
-from networkx_viewer.tokens import NodeToken, EdgeToken
+from networkx_viewer.tokens import NodeToken, EdgeToken, item_token_class
+from networkx_viewer.layout_cache import LayoutCache
+from networkx_viewer.coordinate_map import CoordinateMap
+from networkx_viewer.positions import NodePositions
+from networkx_viewer.tcl_batch import TclBatch
+from networkx_viewer.undo_history import UndoHistory
+from networkx_viewer import session
 
+from contextlib import contextmanager
 from functools import wraps
 def undoable(func):
     """Wrapper to create a savepoint which can be revered to using the
@@ -35,18 +50,23 @@ def undoable(func):
         self = args[0]
         if not self._undo_suspend:
             self._undo_suspend = True # Prevent chained undos
-            self._undo_states.append(self.dump_visualization())
-            # Anytime we do an undoable action, the redo tree gets wiped
-            self._redo_states = []
-            func(*args, **kwargs)
-            self._undo_suspend = False
+            try:
+                self._save_undo_state()
+                func(*args, **kwargs)
+            finally:
+                self._undo_suspend = False
         else:
+            # The first change made in a batch saves its state
+            self._commit_undo()
             func(*args, **kwargs)
     return _wrapper
 
 class GraphCanvas(tk.Canvas):
     """Expandable GUI to plot a NetworkX Graph"""
 
+    # Layout engines which can be selected with the layout_engine kwarg
+    _layout_engines = ('fruchterman_reingold', 'barnes_hut', 'multilevel')
+
     def __init__(self, graph, **kwargs):
         """
         kwargs specific to GraphCanvas:
@@ -55,8 +75,61 @@ class GraphCanvas(tk.Canvas):
                tk.Canvas)
             - EdgeTokenClass = Class to instantiate for a new edge widget.
                Should be inherited from EdgeToken.
+            - node_items = If True, draw node tokens as plain items on this
+               canvas instead of as one widget per node (default False).
+               Much faster with thousands of nodes.  NodeTokenClass is
+               adapted automatically; see tokens.ItemTokenMixin.
+            - virtual = If True, keep node positions in python and only
+               draw the nodes and edges which are in view, adding and
+               removing canvas items as the view is panned and zoomed
+               (default False).  Implies node_items.  See cull_margin.
+            - lod_scales = Zoom levels (see onZoon) at which to draw less
+               detail, such as (0.5, 0.25).  Zoomed out past the first,
+               labels (token items tagged 'label') are hidden and edges are
+               drawn straight; past the second, minor edges are hidden too.
+               Default None, always draw full detail.
+            - edge_importance = Function of an edge's data returning how
+               important it is.  Edges less important than
+               min_edge_importance (default 1) are minor edges; see
+               lod_scales.  Default None, no edges are minor.
             - home_node = Node to plot around when first rendering canvas
             - levels = How many nodes out to also plot when rendering
+            - layout_engine = Force-directed engine used by create_layout.
+               Either 'fruchterman_reingold' (default, exact O(V^2)),
+               'barnes_hut' (quadtree approximation, O(V log V)) or
+               'multilevel' (coarsen-layout-refine using barnes_hut)
+            - multilevel_threshold = Lay out graphs with more nodes than this
+               using the 'multilevel' engine regardless of layout_engine
+               (default 1000).  None to disable.
+            - background_layout = If True, compute layouts in a worker thread
+               and animate the nodes toward their final positions instead of
+               blocking the UI until the layout finishes (default False).
+               See cancel_layout.
+            - layout_cache_size = Number of layouts to remember so that
+               re-plotting the same nodes is instant and looks the same
+               (default 32).  0 to disable the cache.
+            - layout_cache_dir = Directory to also store cached layouts in,
+               so they persist between sessions (default None)
+            - coordinate_map = CoordinateMap (or the path of one saved as a
+               .npy file) with precomputed positions for the nodes of the
+               data graph.  If given, nodes are placed by looking up their
+               positions instead of running create_layout.
+            - component_layout = If True, lay out each connected component
+               of a plot separately and pack them together, rather than
+               laying out islands as one system (default False)
+            - layout_processes = Number of worker processes to lay out large
+               components in parallel with when component_layout is on
+               (default None, one per CPU).  1 to lay out in this process.
+            - progressive = If True, draw large plots a chunk at a time
+               (render_budget ms each) between Tk events, nodes first and
+               then edges, nearest the home node first, so the canvas stays
+               responsive and the home node appears at once (default
+               False).  See cancel_render.
+            - undo_max_entries = Number of undo (and redo) states to keep
+               in memory (default 50).  Older states are compressed and
+               spilled to a temporary file.  See undo_usage.
+            - undo_max_bytes = Most bytes of undo (and redo) states to keep
+               in memory before spilling older ones (default 64 MiB)
 
         """
         ###
@@ -77,13 +150,52 @@ class GraphCanvas(tk.Canvas):
         # This data is used to track panning objects (x,y coords)
         self._pan_data = (None, None)
 
+        # How far the view has been zoomed in (>1) or out (<1) since the
+        #  nodes were plotted
+        self._view_scale = 1.0
+
+        # Drags, pans and zooms waiting to be drawn by _flush_redraw: node
+        #  moves keyed by display node, and the view transform
+        #  (scale, dx, dy) to apply to everything
+        self._pending_moves = {}
+        self._pending_view = None
+        self._redraw_id = None
+
+        # Batch of Tcl commands that drawing edges is queued on while
+        #  plotting (see _batched), and how many round trips to Tcl batching
+        #  has saved so far
+        self._tcl_batch = None
+        self.tcl_round_trips_saved = 0
+
         # List of filters to run whenever trying to add a node to the graph
         self._node_filters = []
 
+        # Bidirectional index between dataG nodes and their dispG ids so
+        #  lookups don't have to scan every displayed node
+        self._data_to_disp = {}
+        self._disp_to_data = {}
+
+        # Map from an edge token's canvas item id to its (u, v, key) in dispG
+        self._edge_tokens = {}
+
         # Undo list
-        self._undo_states = []
-        self._redo_states = []
+        undo_max_entries = kwargs.pop('undo_max_entries', 50)
+        undo_max_bytes = kwargs.pop('undo_max_bytes', 64*2**20)
+        self._undo_states = UndoHistory(undo_max_entries, undo_max_bytes)
+        self._redo_states = UndoHistory(undo_max_entries, undo_max_bytes)
         self._undo_suspend = False
+        # A press has begun a drag or pan which should be undoable if it
+        #  moves anything (see _open_undo)
+        self._undo_pending = False
+
+        # How many batch blocks we're in, and whether _graph_changed was
+        #  called in them
+        self._batch_depth = 0
+        self._batch_changed = False
+
+        # Display nodes drawn since the last _graph_changed, whose tokens
+        #  haven't been told whether they're complete yet
+        self._new_nodes = set()
 
         # Create a display version of this graph
         # If requested, plot only within a certain level of the home node
@@ -102,12 +214,84 @@ class GraphCanvas(tk.Canvas):
         assert issubclass(self._EdgeTokenClass, EdgeToken), \
             "NodeTokenClass must be inherited from NodeToken"
 
+        # Where every displayed node is.  Tk is only ever told where things
+        #  go, never asked.
+        self._positions = NodePositions()
+
+        # Only draw what's in view (plus cull_margin pixels around it).
+        #  _shown is the set of display nodes which are drawn, and display
+        #  nodes are numbered by _new_node_id.
+        self.virtual = kwargs.pop('virtual', False)
+        self.cull_margin = 100
+        self._shown = set()
+        self._node_ids = itertools.count(1)
+        # Every dispG edge, the rows of _positions of its ends and whether
+        #  it's drawn (see _indexed_edges); None once edges are added or
+        #  removed
+        self._edge_index = None
+
+        # Level of detail to draw at, depending on how far we're zoomed out
+        #  (see _apply_detail)
+        self.lod_scales = kwargs.pop('lod_scales', None)
+        self.edge_importance = kwargs.pop('edge_importance', None)
+        self.min_edge_importance = 1
+        self._detail = 0
+
+        # Draw node tokens as items on this canvas rather than as widgets
+        self.node_items = kwargs.pop('node_items', False) or self.virtual
+        if self.node_items:
+            self._NodeTokenClass = item_token_class(self._NodeTokenClass)
+
+        # Engine to use when laying out nodes
+        self.layout_engine = kwargs.pop('layout_engine',
+                                        'fruchterman_reingold')
+        assert self.layout_engine in self._layout_engines, \
+            "layout_engine must be one of %s" % list(self._layout_engines)
+        self.multilevel_threshold = kwargs.pop('multilevel_threshold', 1000)
+
+        # Background layout job (see _start_layout) and how often to poll
+        #  it for new positions, in ms
+        self.background_layout = kwargs.pop('background_layout', False)
+        self.layout_poll_interval = 50
+        self._layout_job = None
+
+        # Progressive drawing job (see _draw_plot) and how long to spend
+        #  drawing between Tk events, in ms
+        self.progressive = kwargs.pop('progressive', False)
+        self.render_budget = 40
+        self._render_job = None
+
+        # Cache of computed layouts.  replot sets _refresh_layout_cache to
+        #  ask for a new layout instead of the cached one.
+        cache_size = kwargs.pop('layout_cache_size', 32)
+        cache_dir = kwargs.pop('layout_cache_dir', None)
+        if cache_size or cache_dir:
+            self.layout_cache = LayoutCache(cache_size, cache_dir)
+        else:
+            self.layout_cache = None
+        self._refresh_layout_cache = False
+
+        # Precomputed positions for the whole data graph, and the scale
+        #  from map to canvas coordinates it was last drawn at
+        self.coordinate_map = kwargs.pop('coordinate_map', None)
+        if isinstance(self.coordinate_map, str):
+            self.coordinate_map = CoordinateMap.load(self.coordinate_map,
+                                                     self.dataG)
+        self._map_scale = None
+
+        # Lay out connected components separately, the ones with at least
+        #  component_pool_min_size nodes in a pool of worker processes
+        self.component_layout = kwargs.pop('component_layout', False)
+        self.layout_processes = kwargs.pop('layout_processes', None)
+        self.component_pool_min_size = 500
+        self._layout_pool = None
+
         ###
         # Now we can do UI things
         ###
         tk.Canvas.__init__(self, **kwargs)
 
-        self._plot_graph(graph)
+        self._plot_graph(graph, home=home_node)
 
         # Center the plot on the home node or first node in graph
         self.center_on_node(home_node or next(iter(graph.nodes())))
@@ -121,9 +305,16 @@ class GraphCanvas(tk.Canvas):
         self.tag_bind('edge', '<Button-1>', self.onEdgeClick)
         self.tag_bind('edge', '<Button-3>', self.onEdgeRightClick)
 
-        self.bind('<ButtonPress-1>', self.onPanStart)
-        self.bind('<ButtonRelease-1>', self.onPanEnd)
-        self.bind('<B1-Motion>', self.onPanMotion)
+        self.bind('<ButtonPress-1>', self._unless_dragging(self.onPanStart))
+        self.bind('<ButtonRelease-1>', self._unless_dragging(self.onPanEnd))
+        self.bind('<B1-Motion>', self._unless_dragging(self.onPanMotion))
+
+        if self.node_items:
+            # Item tokens don't have a widget to bind their events to
+            self.tag_bind('node', '<Button-3>', self.onTokenRightClick)
+            self.tag_bind('node', '<Enter>', lambda e: self.focus_set())
+            self.tag_bind('node', '<Leave>', lambda e: self.master.focus())
+            self.bind('<Key>', self._onCanvasKey)
 
         self.bind_all('<MouseWheel>', self.onZoon)
 
@@ -170,13 +361,17 @@ class GraphCanvas(tk.Canvas):
             elif isinstance(self.dataG, nx.Graph):
                 dataG_id = (u,v)
             self.dispG.add_edge(frm_disp, to_disp, key, dataG_id=dataG_id, dispG_frm=frm_disp, token=token, m=m)
+            self._edge_index = None
 
             x1,y1 = self._node_center(frm_disp)
             x2,y2 = self._node_center(to_disp)
             xa,ya = self._spline_center(x1,y1,x2,y2,m)
 
-            token.render(host_canvas=self, coords=(x1,y1,xa,ya,x2,y2),
-                         directed=directed)
+            if not self.virtual:
+                # (Virtual canvases draw edges once they are in view; see
+                #  _update_viewport)
+                self._render_edge(token, (x1,y1,xa,ya,x2,y2), directed,
+                                  (frm_disp, to_disp, key))
 
             if m > 0:
                 m = -m # Flip sides
@@ -202,23 +397,68 @@ class GraphCanvas(tk.Canvas):
 
         # Create token and draw node
         token = self._NodeTokenClass(self, data, data_node)
-        id = self.create_window(x, y, window=token, anchor=tk.CENTER,
-                                  tags='node')
+        if self.virtual:
+            # Drawn by _update_viewport if it is in view
+            id = token.id
+        elif self.node_items:
+            # Item tokens are drawn centered on the origin
+            id = token.id
+            self.move(token.tag, x, y)
+        else:
+            id = self.create_window(x, y, window=token, anchor=tk.CENTER,
+                                      tags='node')
+        self._positions.add(id, x, y)
         self.dispG.add_node(id, dataG_id=data_node,
                                  token_id=id, token=token)
+        self._data_to_disp[data_node] = id
+        self._disp_to_data[id] = data_node
+        self._new_nodes.add(id)
         return id
 
     def _get_id(self, event, tag='node'):
         for item in self.find_overlapping(event.x-1, event.y-1,
                                                  event.x+1, event.y+1):
-            if tag in self.gettags(item):
+            tags = self.gettags(item)
+            if tag in tags:
+                if tag == 'node' and self.node_items:
+                    # Find the token this item is part of
+                    for t in tags:
+                        if t.startswith('node:'):
+                            return int(t[5:])
                 return item
         raise Exception('No Token Found')
 
+    def _node_tag(self, disp_node):
+        """Tag (or id) of the canvas items which make up disp_node"""
+        if self.node_items:
+            return 'node:%d' % disp_node
+        return disp_node
+
+    def _node_xy(self, disp_node):
+        """Position of disp_node on the canvas"""
+        if self._redraw_id is not None:
+            self._flush_redraw()
+        return self._positions[disp_node]
+
+    def _move_node(self, disp_node, dx, dy):
+        """Move disp_node by dx, dy (without redrawing its edges)"""
+        self._positions.move(disp_node, dx, dy)
+        if self.virtual and disp_node not in self._shown:
+            return
+        self.move(self._node_tag(disp_node), dx, dy)
+
+    def _place_node(self, disp_node, x, y):
+        """Move disp_node to x, y (without redrawing its edges)"""
+        if self.node_items:
+            cx, cy = self._node_xy(disp_node)
+            self._move_node(disp_node, x-cx, y-cy)
+        else:
+            self._positions[disp_node] = (x, y)
+            self.coords(disp_node, x, y)
+
     def _node_center(self, item_id):
         """Calcualte the center of a given node"""
-        b = self.bbox(item_id)
-        return ( (b[0]+b[2])/2, (b[1]+b[3])/2 )
+        return self._node_xy(item_id)
 
     def _spline_center(self, x1, y1, x2, y2, m):
         """Given the coordinate for the end points of a spline, calcuate
@@ -226,11 +466,295 @@ class GraphCanvas(tk.Canvas):
         a = (x2 + x1)/2
         b = (y2 + y1)/2
         beta = (pi/2) - atan2((y2-y1), (x2-x1))
+        # Splines are zoomed along with everything else
+        m = m*self._view_scale
 
         xa = a - m*cos(beta)
         ya = b + m*sin(beta)
         return (xa, ya)
 
+    def _redraw_edges(self, edges):
+        """Recompute the spline of each (u, v, data) edge in dispG from its
+        nodes' current positions"""
+        # (Edges out of view of a virtual canvas aren't drawn)
+        edges = [e for e in edges if e[2]['token'].id is not None]
+        if not edges:
+            return
+        coords = self._edge_coords(edges)
+        self._push_coords([d['token'].id for u, v, d in edges], coords)
+
+    def _edge_coords(self, edges):
+        """(E, 6) array of the spline coordinates x1, y1, xa, ya, x2, y2 of
+        each (u, v, data) edge in dispG, from its nodes' current positions,
+        computed all at once"""
+        import numpy as np
+
+        if self._redraw_id is not None:
+            self._flush_redraw()
+        frm = []
+        to = []
+        m = []
+        for u, v, data in edges:
+            if data['dispG_frm'] != u:
+                # Flip!
+                u, v = v, u
+            frm.append(u)
+            to.append(v)
+            m.append(data['m'])
+        xy = self._positions.xy
+        return _spline_coords(xy[self._positions.rows(frm)],
+                              xy[self._positions.rows(to)],
+                              np.array(m, dtype=float)*self._view_scale)
+
+    def _push_coords(self, items, coords):
+        """Set the coordinates of many canvas items with a single Tcl script
+        instead of a coords call (and round trip) for each.  coords has a
+        row of coordinates per item.  (Inside a _batched block, they are
+        set at the end of it.)"""
+        if hasattr(coords, 'tolist'):
+            coords = coords.tolist()
+        with self._batched() as batch:
+            for item, c in zip(items, coords):
+                batch.coords(item, c)
+
+    def _schedule_redraw(self):
+        """Call _flush_redraw once Tk is idle, if it isn't due already.
+        Motion and wheel events come in faster than we can draw them, so
+        event handlers pile up their changes and this draws them together,
+        once per frame."""
+        if self._redraw_id is None:
+            self._redraw_id = self.after_idle(self._flush_redraw)
+
+    def _flush_redraw(self):
+        """Draw the pending node moves and view transform now"""
+        if self._redraw_id is None:
+            return
+        self.after_cancel(self._redraw_id)
+        self._redraw_id = None
+        moves, self._pending_moves = self._pending_moves, {}
+        view, self._pending_view = self._pending_view, None
+
+        moved = [n for n in moves if n in self.dispG]
+        for n in moved:
+            self._move_node(n, *moves[n])
+        if moved:
+            # Each edge once, even if both its nodes moved
+            edges = {}
+            for u, v, k, d in self.dispG.edges(moved, keys=True, data=True):
+                edges[id(d)] = (u, v, k, d)
+            edges = list(edges.values())
+            self._redraw_edges((u, v, d) for u, v, k, d in edges)
+            if self.virtual:
+                # Edges which were out of view may be now, or the other way
+                #  round
+                self._update_edges_in_view(edges)
+                self._apply_detail(force=True)
+
+        if view is not None:
+            scale, dx, dy = view
+            if abs(1 - scale) < 1e-9:
+                self._pan(dx, dy)
+            else:
+                # Scaling about the point the transform leaves in place
+                self._zoom(dx/(1 - scale), dy/(1 - scale), scale)
+
+    def _transform_view(self, scale, dx, dy):
+        """Scale everything about the canvas origin by scale, then move it
+        by dx, dy, on the next redraw"""
+        s0, dx0, dy0 = self._pending_view or (1.0, 0, 0)
+        self._pending_view = (s0*scale, dx0*scale + dx, dy0*scale + dy)
+        self._schedule_redraw()
+
+    def _new_node_id(self):
+        """Next display node id of a virtual canvas.  (Otherwise, display
+        nodes are identified by a canvas item id.)"""
+        return next(self._node_ids)
+
+    def _view_region(self):
+        """Canvas coordinates (x0, y0, x1, y1) of the part of a virtual
+        canvas which is drawn: what's in view, plus cull_margin"""
+        w = self.winfo_width()
+        h = self.winfo_height()
+        if w <= 1:
+            # We haven't been drawn yet
+            w = int(self['width'])
+            h = int(self['height'])
+        m = self.cull_margin
+        return (-m, -m, w+m, h+m)
+
+    def _update_viewport(self):
+        """Draw the nodes and edges of a virtual canvas which have come into
+        view and delete the items of the ones which have left it"""
+        region = self._view_region()
+        shown = set(self._positions.within(*region))
+        for n in self._shown - shown:
+            self.dispG.nodes[n]['token'].hide()
+        for n in shown - self._shown:
+            self.dispG.nodes[n]['token'].show(*self._positions[n])
+        self._shown = shown
+        self._update_edges_in_view(region=region)
+        # Newly drawn nodes and edges are on top; keep edges below nodes
+        self.tag_lower('edge')
+        self._apply_detail(force=True)
+
+    def _update_edges_in_view(self, edges=None, region=None):
+        """Draw or delete each (u, v, key, data) edge of a virtual canvas
+        (all of them if edges is None) depending on whether it crosses the
+        view.  Which edges do is worked out all at once; only the ones which
+        have come into or left view are touched."""
+        import numpy as np
+
+        if region is None:
+            region = self._view_region()
+        x0, y0, x1, y1 = region
+        indexed = edges is None
+        if indexed:
+            edges, frm, to, drawn = self._indexed_edges()
+        else:
+            edges = list(edges)
+            frm = self._positions.rows([e[0] for e in edges])
+            to = self._positions.rows([e[1] for e in edges])
+            drawn = np.fromiter((e[3]['token'].id is not None for e in edges),
+                                dtype=bool, count=len(edges))
+
+        xy = self._positions.xy
+        u_xy = xy[frm]
+        v_xy = xy[to]
+        lo = np.minimum(u_xy, v_xy)
+        hi = np.maximum(u_xy, v_xy)
+        in_view = ((lo[:, 0] <= x1) & (hi[:, 0] >= x0) &
+                   (lo[:, 1] <= y1) & (hi[:, 1] >= y0))
+        changed = np.flatnonzero(in_view != drawn)
+        with self._batched():
+            for i in changed.tolist():
+                u, v, k, d = edges[i]
+                token = d['token']
+                if in_view[i]:
+                    self._show_edge(u, v, k, d)
+                else:
+                    self._edge_tokens.pop(token.id)
+                    token.delete()
+        if indexed:
+            drawn[changed] = in_view[changed]
+        elif len(changed):
+            # The index's drawn flags are out of date
+            self._edge_index = None
+
+    def _indexed_edges(self):
+        """(edges, frm, to, drawn) of every (u, v, key, data) edge in dispG:
+        arrays of the rows of _positions of its ends and of whether it's
+        drawn.  Built once, then reused until edges are added or removed."""
+        import numpy as np
+
+        if self._edge_index is None:
+            edges = list(self.dispG.edges(keys=True, data=True))
+            rows = self._positions.rows
+            drawn = np.fromiter((d['token'].id is not None
+                                 for u, v, k, d in edges),
+                                dtype=bool, count=len(edges))
+            self._edge_index = (edges, rows([e[0] for e in edges]),
+                                rows([e[1] for e in edges]), drawn)
+        return self._edge_index
+
+    def _show_edge(self, u, v, key, data):
+        """Draw an edge of a virtual canvas which has come into view"""
+        if data['dispG_frm'] != u:
+            # Flip!
+            u, v = v, u
+        from_xy = self._node_center(u)
+        to_xy = self._node_center(v)
+        spline_xy = self._spline_center(*from_xy+to_xy+(data['m'],))
+        self._render_edge(data['token'], from_xy+spline_xy+to_xy,
+                          self.dataG.is_directed(), (u, v, key))
+
+    def _render_edge(self, token, coords, directed, edge):
+        """Draw edge token's spline.  edge is its (u, v, key) in dispG.  If a
+        Tcl batch is open (see _batched), its create_line is queued on that,
+        unless the token draws itself some other way."""
+        batch = self._tcl_batch
+        if batch is None or type(token).render is not EdgeToken.render:
+            token.render(host_canvas=self, coords=coords, directed=directed)
+            self._edge_tokens[token.id] = edge
+            self._tag_minor_edge(token)
+            # Show the edge's marked status (it may have been marked before
+            #  it was drawn)
+            if token.is_marked:
+                token._setstate(token.__getstate__())
+            return
+
+        cfg = token.line_cfg(directed=directed)
+        if self._is_minor_edge(token):
+            cfg['tags'] = ('edge', 'minor_edge')
+        def _drawn(spline_id):
+            token._drawn(self, spline_id)
+            self._edge_tokens[spline_id] = edge
+            if token.is_marked:
+                token._setstate(token.__getstate__())
+        batch.create('line', coords, cfg, _drawn)
+
+    @contextmanager
+    def _batched(self):
+        """Queue the Tcl commands for drawing edges inside the with block
+        and run them, a few scripts' worth, at the end of it"""
+        if self._tcl_batch is not None:
+            # Already batching
+            yield self._tcl_batch
+            return
+        batch = self._tcl_batch = TclBatch(self)
+        try:
+            yield batch
+        finally:
+            self._tcl_batch = None
+            batch.run()
+            self.tcl_round_trips_saved += batch.round_trips_saved
+
+    def _tag_minor_edge(self, token):
+        """Tag a newly drawn edge 'minor_edge' if it is (see
+        edge_importance)"""
+        if self._is_minor_edge(token):
+            self.addtag_withtag('minor_edge', token.id)
+
+    def _is_minor_edge(self, token):
+        return (self.edge_importance is not None and
+                self.edge_importance(token.edge_data) <
+                self.min_edge_importance)
+
+    def _detail_level(self):
+        """Level of detail to draw at for the current zoom: 0 for full
+        detail, 1 without labels and with straight edges, 2 also without
+        minor edges.  See lod_scales."""
+        if not self.lod_scales:
+            return 0
+        return sum(1 for s in self.lod_scales[:2] if self._view_scale < s)
+
+    def _apply_detail(self, force=False):
+        """Hide or show labels, curves and minor edges if the level of
+        detail has changed.  If force, also apply it to items drawn since
+        it last changed."""
+        level = self._detail_level()
+        if level == self._detail and (level == 0 or not force):
+            # Items are drawn in full detail to begin with
+            return
+        self._detail = level
+
+        label_state = tk.HIDDEN if level >= 1 else tk.NORMAL
+        if self.node_items:
+            self.itemconfig('label', state=label_state)
+        else:
+            for n, d in self.dispG.nodes(data=True):
+                d['token'].itemconfig('label', state=label_state)
+        self.itemconfig('edge', smooth=(level == 0))
+        self.itemconfig('minor_edge',
+                        state=tk.HIDDEN if level >= 2 else tk.NORMAL)
+
+    def _pan(self, dx, dy):
+        """Move everything on the canvas by dx, dy"""
+        self._positions.translate(dx, dy)
+        self._transform_render(1.0, dx, dy)
+        self.move(tk.ALL, dx, dy)
+        if self.virtual:
+            self._update_viewport()
+
 
     def _neighbors(self, node, levels=1, graph=None):
         """Return graph of neighbors around node in graph (default: self.dataG)
@@ -347,8 +871,26 @@ class GraphCanvas(tk.Canvas):
               filter_lambda + "\n\nraised the following " +
               "exception:\n\n" + str(e))
 
-    @undoable
+    def _unless_dragging(self, func):
+        """Wrap canvas event handler func to ignore events which are part of
+        dragging a node.  The canvas also sees the events of item tokens,
+        after the node's own handlers have run."""
+        def _wrapper(event):
+            if self._drag_data['item'] is None:
+                return func(event)
+        return _wrapper
+
+    def _onCanvasKey(self, event):
+        """Pass key presses over item tokens on to onNodeKey"""
+        try:
+            self._get_id(event)
+        except Exception:
+            # Not over a node
+            return
+        self.onNodeKey(event)
+
     def onPanStart(self, event):
+        self._open_undo()
         self._pan_data = (event.x, event.y)
         self.winfo_toplevel().config(cursor='fleur')
 
@@ -356,12 +898,15 @@ class GraphCanvas(tk.Canvas):
         # compute how much to move
         delta_x = event.x - self._pan_data[0]
         delta_y = event.y - self._pan_data[1]
-        self.move(tk.ALL, delta_x, delta_y)
+        if delta_x or delta_y:
+            self._commit_undo()
+        self._transform_view(1.0, delta_x, delta_y)
 
         # Record new location
         self._pan_data = (event.x, event.y)
 
     def onPanEnd(self, event):
+        self._undo_pending = False
         self._pan_data = (None, None)
         self.winfo_toplevel().config(cursor='arrow')
 
@@ -372,34 +917,42 @@ class GraphCanvas(tk.Canvas):
         x = (event.widget.winfo_rootx() + event.x) - self.winfo_rootx()
         y = (event.widget.winfo_rooty() + event.y) - self.winfo_rooty()
 
-        # Move everyone proportional to how far they are from the cursor
-        ids = self.find_withtag('node') # + self.find_withtag('edge')
-
-        for i in ids:
-            ix, iy, t1, t2 = self.bbox(i)
-
-            dx = (x-ix)*factor
-            dy = (y-iy)*factor
-
-            self.move(i, dx, dy)
-
-        # Redraw all the edges
-        for to_node, from_node, data in self.dispG.edges(data=True):
-            from_xy = self._node_center(from_node)
-            to_xy = self._node_center(to_node)
-            if data['dispG_frm'] != from_node:
-                # Flip!
-                a = from_xy[:]
-                from_xy = to_xy[:]
-                to_xy = a[:]
-            spline_xy = self._spline_center(*from_xy+to_xy+(data['m'],))
-
-            data['token'].coords((from_xy+spline_xy+to_xy))
+        # Scale about the cursor, along with any wheel events since the
+        #  last redraw
+        scale = 1 - factor
+        self._transform_view(scale, x*factor, y*factor)
+
+    def _zoom(self, x, y, scale):
+        """Scale the view about x, y"""
+        # Move everyone proportional to how far they are from the cursor.
+        #  This is a single view transform, so let Tk scale the coordinates
+        #  of every item at once instead of moving nodes and redrawing
+        #  edges one by one.
+        self._view_scale *= scale
+        before = self._positions.xy.copy()
+        self._positions.scale(x, y, scale)
+        self._transform_render(scale, x*(1 - scale), y*(1 - scale))
+        if self.node_items:
+            # Scaling would also resize the tokens' shapes, so only the
+            #  edges are scaled and the tokens are moved
+            nodes = list(self._shown) if self.virtual else \
+                    self._positions.nodes
+            rows = self._positions.rows(nodes)
+            moves = (self._positions.xy[rows] - before[rows]).tolist()
+            for n, (dx, dy) in zip(nodes, moves):
+                self.move(self._node_tag(n), dx, dy)
+            self.scale('edge', x, y, scale, scale)
+            if self.virtual:
+                self._update_viewport()
+        else:
+            # Window items are moved but keep their size
+            self.scale(tk.ALL, x, y, scale, scale)
+        self._apply_detail()
 
 
-    @undoable
     def onNodeButtonPress(self, event):
         """Being drag of an object"""
+        self._open_undo()
         # record the item and its location
         item = self._get_id(event)
         self._drag_data["item"] = item
@@ -417,6 +970,7 @@ class GraphCanvas(tk.Canvas):
 
     def onNodeButtonRelease(self, event):
         """End drag of an object"""
+        self._undo_pending = False
 
         # reset the drag information
         self._drag_data['item'] = None
@@ -431,25 +985,18 @@ class GraphCanvas(tk.Canvas):
         # compute how much this object has moved
         delta_x = event.x - self._drag_data['x']
         delta_y = event.y - self._drag_data['y']
-        # move the object the appropriate amount
-        self.move(self._drag_data['item'], delta_x, delta_y)
+        if delta_x or delta_y:
+            self._commit_undo()
+        # move the object the appropriate amount, along with its edges, on
+        #  the next redraw
+        item = self._drag_data['item']
+        dx, dy = self._pending_moves.get(item, (0, 0))
+        self._pending_moves[item] = (dx+delta_x, dy+delta_y)
+        self._schedule_redraw()
         # record the new position
         self._drag_data["x"] = event.x
         self._drag_data["y"] = event.y
 
-        # Redraw any edges
-        from_node = self._drag_data['item']
-        from_xy = self._node_center(from_node)
-        for _, to_node, edge in self.dispG.edges(from_node, data=True):
-            to_xy = self._node_center(to_node)
-            if edge['dispG_frm'] != from_node:
-                # Flip!
-                spline_xy = self._spline_center(*to_xy+from_xy+(edge['m'],))
-                edge['token'].coords((to_xy+spline_xy+from_xy))
-            else:
-                spline_xy = self._spline_center(*from_xy+to_xy+(edge['m'],))
-                edge['token'].coords((from_xy+spline_xy+to_xy))
-
     def onTokenRightClick(self, event):
         item = self._get_id(event)
 
@@ -491,8 +1038,9 @@ class GraphCanvas(tk.Canvas):
 
         if nodes is None:
             raise ValueError('No radial string detected')
-        for n in nodes:
-            self.hide_node(n)
+        with self.batch():
+            for n in nodes:
+                self.hide_node(n)
 
     def onNodeKey(self, event):
         item = self._get_id(event)
@@ -527,8 +1075,7 @@ class GraphCanvas(tk.Canvas):
             if stop_condition is None: return
 
         data_node = self.dispG.nodes(data=True)[disp_node]['dataG_id']
-        existing_data_nodes = set([ v['dataG_id']
-                                    for k,v in self.dispG.nodes(data=True) ])
+        existing_data_nodes = set(self._data_to_disp)
 
         max_iters = 10
         stop_node = None    # Node which met stop condition
@@ -574,18 +1121,27 @@ class GraphCanvas(tk.Canvas):
 
     @undoable
     def hide_node(self, disp_node):
+        self._remove_node(disp_node)
+        self._graph_changed()
 
+    def _remove_node(self, disp_node):
+        """Remove disp_node and its edges from display"""
         # Remove all the edges from display
         for n, m, d in self.dispG.edges(disp_node, data=True):
+            self._edge_tokens.pop(d['token'].id, None)
             d['token'].delete()
 
         # Remove the node from display
-        self.delete(disp_node)
+        self.delete(self._node_tag(disp_node))
+        self._positions.remove(disp_node)
+        self._shown.discard(disp_node)
+        self._new_nodes.discard(disp_node)
+        self._edge_index = None
 
         # Remove the node from dispG
         self.dispG.remove_node(disp_node)
-
-        self._graph_changed()
+        data_node = self._disp_to_data.pop(disp_node)
+        del self._data_to_disp[data_node]
 
     @undoable
     def mark_node(self, disp_node):
@@ -601,7 +1157,7 @@ class GraphCanvas(tk.Canvas):
         except ValueError as e:
             tkm.showerror("Unable to find node", str(e))
             return
-        x,y = self.coords(self.dispG.nodes[disp_node]['token_id'])
+        x,y = self._node_xy(disp_node)
 
         # Find center of canvas
         w = self.winfo_width()/2
@@ -615,13 +1171,12 @@ class GraphCanvas(tk.Canvas):
         delta_x = w - x
         delta_y = h - y
 
-        self.move(tk.ALL, delta_x, delta_y)
+        self._pan(delta_x, delta_y)
 
     def onEdgeRightClick(self, event):
         item = self._get_id(event, 'edge')
-        for u,v,k,d in self.dispG.edges(keys=True, data=True):
-            if d['token'].id == item:
-                break
+        u, v, k = self._edge_tokens[item]
+        d = self.dispG.edges[u, v, k]
 
         popup = tk.Menu(self, tearoff=0)
         popup.add_command(label='Mark', command=lambda: self.mark_edge(u,v,k))
@@ -634,9 +1189,7 @@ class GraphCanvas(tk.Canvas):
 
     def onEdgeClick(self, event):
         item = self._get_id(event, 'edge')
-        for u,v,k,d in self.dispG.edges(keys=True, data=True):
-            if d['token'].id == item:
-                break
+        u, v, k = self._edge_tokens[item]
         dataG_id = self.dispG.edges[u, v, k]['dataG_id']
         self.onEdgeSelected(dataG_id, self.dataG.get_edge_data(*dataG_id))
 
@@ -664,8 +1217,24 @@ class GraphCanvas(tk.Canvas):
 
     def clear(self):
         """Clear the canvas and display graph"""
+        self._stop_render()
+        self.cancel_layout()
+        if self._redraw_id is not None:
+            self.after_cancel(self._redraw_id)
+            self._redraw_id = None
+        self._pending_moves.clear()
+        self._pending_view = None
         self.delete(tk.ALL)
+        self._view_scale = 1.0
+        self._detail = 0
         self.dispG.clear()
+        self._data_to_disp.clear()
+        self._disp_to_data.clear()
+        self._edge_tokens.clear()
+        self._positions.clear()
+        self._shown.clear()
+        self._new_nodes.clear()
+        self._edge_index = None
 
     @undoable
     def plot(self, home_node, levels=1):
@@ -673,7 +1242,7 @@ class GraphCanvas(tk.Canvas):
         self.clear()
 
         graph = self._neighbors(home_node, levels=levels)
-        self._plot_graph(graph)
+        self._plot_graph(graph, home=home_node)
 
         if isinstance(home_node, (list, tuple, set)):
             self.center_on_node(home_node[0])
@@ -688,8 +1257,7 @@ class GraphCanvas(tk.Canvas):
         new_nodes = self._neighbors(home_nodes, levels=levels)
         new_nodes = home_nodes.union(new_nodes)
 
-        displayed_data_nodes = set([ v['dataG_id']
-                            for k,v in self.dispG.nodes.items() ])
+        displayed_data_nodes = set(self._data_to_disp)
 
         # It is possible the new nodes create a connection with the existing
         #  nodes; in such a case, we don't need to try to find the shortest
@@ -741,7 +1309,7 @@ class GraphCanvas(tk.Canvas):
 
         # Add current x,y info to the graph
         for n, d in ans.nodes(data=True):
-            (d['x'],d['y']) = self.coords(d['token_id'])
+            (d['x'],d['y']) = self._node_xy(n)
 
         # Pickle the whole thing up
         ans = pickle.dumps(ans)
@@ -749,55 +1317,265 @@ class GraphCanvas(tk.Canvas):
         return ans
 
     def load_visualization(self, dump):
-        """Load a visualization as created by dump_visulaization method"""
+        """Load a visualization as created by dump_visulaization method.
+        Only what differs from the current display is changed: missing nodes
+        and edges are drawn, extra ones removed, displaced nodes moved back
+        and tokens whose state differs have it restored."""
         # Unpickle string into nx graph
         G = pickle.loads(dump)
 
-        # Clear us and rebuild
-        self.clear()
-        bad_nodes = set()
-        for n, d in G.nodes(data=True):
-            try:
-                id = self._draw_node((d['x'],d['y']), d['dataG_id'])
-            except KeyError as e:
-                tkm.showerror("Model Error",
-                "Substation no longer exists: %s" % e)
-                bad_nodes.add(e.message)
-                continue
-            state = d['token'].__getstate__()
-            self.dispG.nodes[id]['token']._setstate(state)
-
-        for u, v in set(G.edges()):
+        nodes = dict((d['dataG_id'], (d['x'], d['y'], d['token'].__getstate__()))
+                     for n, d in G.nodes(data=True))
+        edges = collections.defaultdict(dict)
+        for u, v, k, d in G.edges(keys=True, data=True):
             # Find dataG ids from old dispG
             uu = G.nodes[u]['dataG_id']
             vv = G.nodes[v]['dataG_id']
-            if uu in bad_nodes: continue
-            if vv in bad_nodes: continue
-            try:
-                self._draw_edge(uu,vv)
-            except KeyError as e:
-                tkm.showerror("Model Error",
-                "Model no longer the same around %s" % e)
-                continue
-
-            state = d['token'].__getstate__()
-            self.dispG.nodes[id]['token']._setstate(state)
-
-            # Find new dispG ids from dataG ids
-            uuu = self._find_disp_node(uu)
-            vvv = self._find_disp_node(vv)
+            if d['dispG_frm'] != u:
+                uu, vv = vv, uu
+            edges[frozenset((uu, vv))][k] = (uu, vv, d['token'].__getstate__())
+
+        self._load_display(nodes, edges)
+
+    def save_session(self, path, compress=True):
+        """Save the nodes being displayed, their positions and which nodes
+        and edges are marked to path, in the session format (see
+        networkx_viewer.session).  Smaller and quicker than
+        dump_visualization, and readable by later versions.  Only marks are
+        saved of the tokens' state."""
+        import numpy as np
+
+        if self._redraw_id is not None:
+            self._flush_redraw()
+        positions = self._positions
+        disp_nodes = positions.nodes
+        node_ids = [self._disp_to_data[n] for n in disp_nodes]
+        node_marked = np.fromiter(
+            (self.dispG.nodes[n]['token'].is_marked for n in disp_nodes),
+            dtype=bool, count=len(disp_nodes))
+
+        edges = list(self.dispG.edges(keys=True, data=True))
+        frm = []
+        to = []
+        for u, v, k, d in edges:
+            if d['dispG_frm'] != u:
+                u, v = v, u
+            frm.append(u)
+            to.append(v)
+        edge_ends = np.column_stack((positions.rows(frm), positions.rows(to)))
+        edge_keys = [k for u, v, k, d in edges]
+        edge_marked = [d['token'].is_marked for u, v, k, d in edges]
+
+        # Write to a temporary file and move it into place, so a failed
+        #  save doesn't clobber what was at path
+        fd, tmp_path = tempfile.mkstemp(
+            suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                session.write_session(f, node_ids, positions.xy, node_marked,
+                                      edge_ends, edge_keys, edge_marked,
+                                      view_scale=self._view_scale,
+                                      compress=compress)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def open_session(self, path):
+        """Display the session saved to path by save_session.  Raises
+        ValueError if path isn't a session file it can read."""
+        # Read the whole file before changing anything, so a bad file
+        #  leaves the display (and undo history) alone
+        with open(path, 'rb') as f:
+            saved = session.read_session(f)
+        self._show_session(saved)
 
-            # Set state for the new edge(s)
-            for k, ed in self.dispG.get_edge_data(uuu, vvv).items():
+    @undoable
+    def _show_session(self, saved):
+        """Display a session read by session.read_session"""
+        ids = saved['node_ids']
+        nodes = {}
+        for u, (x, y), marked in zip(ids, saved['node_xy'].tolist(),
+                                     saved['node_marked'].tolist()):
+            nodes[u] = (x, y, {'_marked': marked})
+        edges = collections.defaultdict(dict)
+        for (i, j), k, marked in zip(saved['edge_ends'].tolist(),
+                                     saved['edge_keys'],
+                                     saved['edge_marked'].tolist()):
+            edges[frozenset((ids[i], ids[j]))][k] = (ids[i], ids[j],
+                                                     {'_marked': marked})
+
+        rescaled = saved['view_scale'] != self._view_scale
+        self._view_scale = saved['view_scale']
+        self._load_display(nodes, edges)
+        if rescaled:
+            # Every spline's bend depends on the zoom
+            self._redraw_edges(self.dispG.edges(data=True))
+
+    def _load_display(self, nodes, edges):
+        """Change the display to show nodes, {dataG node: (x, y, state)},
+        and edges, {frozenset of dataG ends: {key: (from, to, state)}}, where
+        state is (some of) a token's __getstate__.  Only what differs from
+        the current display is changed."""
+        self._stop_render()
+        self.cancel_layout()
+
+        # Remove nodes which aren't in the visualization
+        for n in [n for n, u in self._disp_to_data.items()
+                  if u not in nodes]:
+            self._remove_node(n)
+
+        # Draw missing nodes and move the rest into place
+        bad_nodes = set()
+        moved = []
+        for data_node, (x, y, state) in nodes.items():
+            id = self._data_to_disp.get(data_node)
+            if id is None:
                 try:
-                    state = G.edges[u, v, k]['token'].__getstate__()
+                    id = self._draw_node((x, y), data_node)
                 except KeyError as e:
                     tkm.showerror("Model Error",
-                    "Line different between models: %s" % e)
-                ed['token']._setstate(state)
+                    "Substation no longer exists: %s" % e)
+                    bad_nodes.add(data_node)
+                    continue
+                if id is None:
+                    # Filtered out
+                    continue
+            elif self._node_xy(id) != (x, y):
+                self._place_node(id, x, y)
+                moved.append(id)
+            self._restore_token(self.dispG.nodes[id]['token'], state)
+
+        # Edges being displayed, keyed the same way
+        current = collections.defaultdict(dict)
+        for u, v, k, d in self.dispG.edges(keys=True, data=True):
+            ends = frozenset((self._disp_to_data[u], self._disp_to_data[v]))
+            current[ends][k] = (u, v, d['token'])
+
+        # Remove edges which aren't in the visualization (or are, but
+        #  between nodes with a different number of edges now)
+        for ends, drawn in current.items():
+            if set(drawn) == set(edges.get(ends, ())):
+                continue
+            for k, (u, v, token) in drawn.items():
+                self._edge_tokens.pop(token.id, None)
+                token.delete()
+                self.dispG.remove_edge(u, v, k)
+                self._edge_index = None
+
+        with self._batched():
+            for ends, saved in edges.items():
+                if ends & bad_nodes:
+                    continue
+                if set(saved) == set(current.get(ends, ())):
+                    # Already drawn
+                    for k, (u, v, token) in current[ends].items():
+                        self._restore_token(token, saved[k][2])
+                    continue
+
+                uu, vv, state = next(iter(saved.values()))
+                try:
+                    self._draw_edge(uu,vv)
+                except KeyError as e:
+                    tkm.showerror("Model Error",
+                    "Model no longer the same around %s" % e)
+                    continue
 
+                # Find new dispG ids from dataG ids
+                try:
+                    uuu = self._find_disp_node(uu)
+                    vvv = self._find_disp_node(vv)
+                except (NodeFiltered, ValueError):
+                    continue
+
+                # Set state for the new edge(s)
+                for k, ed in self.dispG.get_edge_data(uuu, vvv).items():
+                    try:
+                        state = saved[k][2]
+                    except KeyError as e:
+                        tkm.showerror("Model Error",
+                        "Line different between models: %s" % e)
+                        continue
+                    self._restore_token(ed['token'], state)
+
+        self._redraw_edges(self.dispG.edges(moved, data=True))
         self.refresh()
 
+    def _restore_token(self, token, state):
+        """Give token state (some or all of what its __getstate__ returns),
+        if it doesn't have it already"""
+        current = token.__getstate__()
+        if all(current.get(k) == v for k, v in state.items()):
+            return
+        if token.is_marked:
+            # Unmark first so _setstate starts from the unmarked look
+            token.mark()
+        token._setstate(state)
+        if isinstance(token, NodeToken):
+            self._show_complete(token)
+
+    def _show_complete(self, token):
+        """Make node token look as complete as it thinks it is (after
+        something like render may have changed its look)"""
+        if token.is_complete:
+            token.mark_complete()
+        else:
+            token.mark_incomplete()
+
+    @contextmanager
+    def batch(self):
+        """Context manager to make the changes inside its with block as one:
+        they're undone together, and completeness indicators (see
+        _graph_changed) and pending redraws are only updated once, at the
+        end.  Batches may be nested; only the outermost one counts.
+
+        Typical use:
+            >>> with canvas.batch():
+            ...     for n in nodes:
+            ...         canvas.hide_node(n)
+        """
+        outer = self._batch_depth == 0
+        suspend_undo = outer and not self._undo_suspend
+        if suspend_undo:
+            # Only saved once something undoable is done, so a batch which
+            #  changes nothing leaves the undo and redo history alone
+            self._open_undo()
+            self._undo_suspend = True
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if suspend_undo:
+                self._undo_suspend = False
+                self._undo_pending = False
+            if outer:
+                if self._batch_changed:
+                    self._batch_changed = False
+                    self._graph_changed()
+                self._flush_redraw()
+
+    def _save_undo_state(self):
+        """Save the current state to be undone to"""
+        self._undo_states.push(self.dump_visualization())
+        # Anytime we do an undoable action, the redo tree gets wiped
+        self._redo_states.clear()
+        self._undo_pending = False
+
+    def _open_undo(self):
+        """Begin an interaction, such as a drag, which can be undone if it
+        changes anything.  Saving the state is put off until
+        _commit_undo says it has, so a click which doesn't change anything
+        costs nothing and leaves the redo history alone."""
+        self._undo_pending = not self._undo_suspend
+
+    def _commit_undo(self):
+        """The interaction begun by _open_undo is about to change something;
+        save the state from before it (once)"""
+        if self._undo_pending:
+            self._undo_pending = False
+            self._save_undo_state()
+
     def undo(self):
         """Undoes the last action marked with the undoable decorator"""
         try:
@@ -805,7 +1583,7 @@ class GraphCanvas(tk.Canvas):
         except IndexError:
             # No undoable states (empty list)
             return
-        self._redo_states.append(self.dump_visualization())
+        self._redo_states.push(self.dump_visualization())
         self.load_visualization(state)
 
     def redo(self):
@@ -816,6 +1594,20 @@ class GraphCanvas(tk.Canvas):
             return
         self.load_visualization(state)
 
+    def undo_usage(self):
+        """Dict of how much the undo and redo history is taking up:
+            - entries = Number of states saved
+            - memory_bytes = Bytes of states held in memory
+            - spilled_entries = Number of states spilled to disk
+            - disk_bytes = Bytes of (compressed) states on disk"""
+        histories = (self._undo_states, self._redo_states)
+        return {
+            'entries': sum(len(h) for h in histories),
+            'memory_bytes': sum(h.memory_usage for h in histories),
+            'spilled_entries': sum(h.spilled for h in histories),
+            'disk_bytes': sum(h.disk_usage for h in histories),
+        }
+
     @undoable
     def replot(self):
         """Replot existing nodes, hopefully providing a better layout"""
@@ -828,39 +1620,53 @@ class GraphCanvas(tk.Canvas):
         edges_marked = [d['dataG_id']
                         for u,v,k,d in self.dispG.edges(data=True, keys=True)
                         if d['token'].is_marked]
-        # Replot
-        self.plot(nodes, levels=0)
-
-        # Remark
-        for n in nodes_marked:
-            self.mark_node(self._find_disp_node(n))
-        edge_map = {d['dataG_id']: (u,v,k)
-                    for u,v,k,d in self.dispG.edges(data=True, keys=True)}
-        for dataG_id in edges_marked:
-            self.mark_edge(*edge_map[dataG_id])
+        with self.batch():
+            # Replot, asking for a new layout rather than the cached one
+            self._refresh_layout_cache = True
+            try:
+                self.plot(nodes, levels=0)
+            finally:
+                self._refresh_layout_cache = False
+            # The marked nodes and edges have to be drawn to be remarked
+            self._finish_render()
+
+            # Remark
+            for n in nodes_marked:
+                self.mark_node(self._find_disp_node(n))
+            edge_map = {d['dataG_id']: (u,v,k)
+                        for u,v,k,d in self.dispG.edges(data=True, keys=True)}
+            for dataG_id in edges_marked:
+                self.mark_edge(*edge_map[dataG_id])
 
     def refresh(self):
         """Redrawn nodes and edges, updating any display attributes that
         maybe have changed in the underlying tokens.
-        This method should be called anytime the underling data graph changes"""
+        This method should be called anytime the underling data graph changes.
+
+        Only tokens whose attributes differ from those they were last drawn
+        with are touched, and they update their existing items in place.
+        Returns how many tokens were updated."""
+        changed = 0
 
         # Edges
         for u,v,k,d in self.dispG.edges(keys=True, data=True):
             token = d['token']
             dataG_id = d['dataG_id']
-            token.edge_data = self.dataG.get_edge_data(*dataG_id)
-            token.itemconfig()  # Refreshed edge's display
+            changed += token.refresh(self.dataG.get_edge_data(*dataG_id))
 
         # Nodes
         for u, d in self.dispG.nodes(data=True):
             token = d['token']
             node_name = d['dataG_id']
             data = self.dataG.nodes[node_name]
-            token.render(data, node_name)
+            if token.refresh(data, node_name):
+                changed += 1
+                self._show_complete(token)
 
         # Update fully expanded status
         self._graph_changed()
 
+        return changed
 
     @undoable
     def plot_path(self, frm_node, to_node, levels=1, add_to_exsting=False):
@@ -883,10 +1689,12 @@ class GraphCanvas(tk.Canvas):
             self._plot_additional(graph.nodes())
         else:
             self.clear()
-            self._plot_graph(graph)
+            self._plot_graph(graph, home=path[0])
 
         # Mark the path
         if levels > 0 or add_to_exsting:
+            # The path's edges have to be drawn before they can be marked
+            self._finish_render()
             for u, v in zip(path[:-1], path[1:]):
                 u_disp = self._find_disp_node(u)
                 v_disp = self._find_disp_node(v)
@@ -895,7 +1703,10 @@ class GraphCanvas(tk.Canvas):
 
 
 
-    def _plot_graph(self, graph):
+    def _plot_graph(self, graph, home=None):
+        """Plot graph on the (cleared) canvas.  home is the node (or list
+        of nodes) the plot is centered on; it's drawn first when drawing
+        progressively."""
         # Create nodes
         scale = min(self.winfo_width(), self.winfo_height())
         if scale == 1:
@@ -903,21 +1714,50 @@ class GraphCanvas(tk.Canvas):
             scale = int(min(self['width'], self['height']))
 
         scale -= 50
-        if len(graph) > 1:
-            layout = self.create_layout(graph, scale=scale, min_distance=50)
+        refresh = self._refresh_layout_cache
+        layout = None
+        if self.coordinate_map is not None and len(graph) > 1:
+            # Look the positions up instead of laying out
+            layout = self._mapped_layout(graph, scale=scale)
+        background = (self.background_layout and len(graph) > 1 and
+                      layout is None)
+        if background:
+            # No need to animate a layout we already know
+            layout, seed = self._cached_layout(graph, refresh, scale=scale,
+                                               min_distance=50)
+            background = layout is None
+        if background:
+            # Draw the nodes at their starting positions; a worker thread
+            #  will animate them into place
+            start = self._initial_positions(graph, seed=seed)
+            layout = self._rescale_positions(start, scale)
+        elif len(graph) > 1 and layout is None:
+            layout = self.create_layout(graph, scale=scale, min_distance=50,
+                                        refresh_cache=refresh)
 
+        if len(graph) > 1:
             # Find min distance between any node and make sure that is at least
             #  as big as
-            for n in graph.nodes():
-                self._draw_node(layout[n]+20, n)
+            positions = dict((n, layout[n]+20) for n in graph.nodes())
+        else:
+            positions = {list(graph.nodes())[0]: (scale/2, scale/2)}
+
+        if isinstance(home, (list, tuple, set)):
+            home = [n for n in home if n in graph]
+        elif home in graph:
+            home = [home]
         else:
-            self._draw_node((scale/2, scale/2), list(graph.nodes())[0])
+            home = list(graph.nodes())[:1]
 
-        # Create edges
-        for frm, to in set(graph.edges()):
-            self._draw_edge(frm, to)
+        def finish():
+            self._graph_changed()
 
-        self._graph_changed()
+            if background:
+                self._start_layout(graph, offset=20, pos=start, scale=scale,
+                                   min_distance=50, refresh_cache=refresh)
+
+        self._draw_plot(graph, positions, graph.nodes(), set(graph.edges()),
+                        home, finish)
 
     def _plot_additional(self, nodes):
         """Add a set of nodes to the graph, kepping all already
@@ -929,8 +1769,7 @@ class GraphCanvas(tk.Canvas):
         # ploted but are not immediate neighbors, so that we can successfully
         # capture their edges.  To do this, we should subgraph the data graph
         # using the nodes of the grow graph and existing data nodes
-        existing_data_nodes = set([ v['dataG_id']
-                            for k,v in self.dispG.nodes.items() ])
+        existing_data_nodes = set(self._data_to_disp)
         nodes = set(nodes).union(existing_data_nodes)
         grow_graph = self.dataG.subgraph(nodes)
 
@@ -938,10 +1777,26 @@ class GraphCanvas(tk.Canvas):
         #  argument to center around the home node (ie, "disp_node")
         fixed = {}
         for n,d in self.dispG.nodes(data=True):
-            fixed[d['dataG_id']] = self.coords(n)
-
-        layout = self.create_layout(grow_graph,
-                                    pos=fixed, fixed=list(fixed.keys()))
+            fixed[d['dataG_id']] = self._node_xy(n)
+
+        layout = None
+        if self.coordinate_map is not None:
+            # Look the new positions up instead of laying out
+            layout = self._mapped_layout(grow_graph, fixed=fixed)
+        background = self.background_layout and layout is None
+        if background:
+            layout, seed = self._cached_layout(grow_graph, pos=fixed,
+                                               fixed=list(fixed.keys()))
+            background = layout is None
+        if background:
+            # Draw new nodes at their starting positions; a worker thread
+            #  will animate them into place
+            layout = self._initial_positions(grow_graph, fixed, seed)
+            self.cancel_layout()
+        elif layout is None:
+            layout = self.create_layout(grow_graph,
+                                        pos=fixed, fixed=list(fixed.keys()))
+        layout_graph = grow_graph
 
         # Unfreeze graph
         grow_graph = type(grow_graph)(grow_graph)
@@ -962,18 +1817,358 @@ class GraphCanvas(tk.Canvas):
             return
 
         # Plot the new nodes and add to the disp graph
-        for n in grow_graph.nodes():
-            if n in existing_data_nodes: continue
-            self._draw_node(layout[n], n)
+        new_nodes = [n for n in grow_graph.nodes()
+                     if n not in existing_data_nodes]
+        new_edges = [(n, m) for n, m in set(grow_graph.edges())
+                     if not ((n in existing_data_nodes) and
+                             (m in existing_data_nodes))]
+
+        def finish():
+            self._graph_changed()
+
+            if background:
+                self._start_layout(layout_graph, pos=layout,
+                                   fixed=list(fixed.keys()))
+
+        # Draw outward from what's already plotted
+        self._draw_plot(grow_graph, layout, new_nodes, new_edges,
+                        existing_data_nodes, finish)
+
+    def _draw_plot(self, graph, layout, nodes, edges, home, finish):
+        """Draw nodes (of graph, at their positions in layout) then edges
+        (pairs of data nodes), and call finish once they're all drawn.
+
+        If progressive, they're drawn a chunk at a time by _render_chunk,
+        each node and edge in order of how many hops it is from the
+        nearest of the home nodes.  The first chunk is drawn before
+        returning."""
+        if not self.progressive:
+            for n in nodes:
+                self._draw_node(layout[n], n)
+            with self._batched():
+                for u, v in edges:
+                    self._draw_edge(u, v)
+            finish()
+            return
 
-        for n, m in set(grow_graph.edges()):
-            if (n in existing_data_nodes) and (m in existing_data_nodes):
-                continue
+        # Only one plot is drawn at a time
+        self._stop_render()
+
+        dist = _hops(graph, home)
+        far = len(graph)
+        # Home nodes first, in the order given, so the node plot centers on
+        #  is drawn in the first chunk
+        order = dict((n, i) for i, n in enumerate(home))
+        nodes = sorted(nodes, key=lambda n: (dist.get(n, far),
+                                             order.get(n, len(order))))
+        edges = sorted(edges, key=lambda e: min(dist.get(e[0], far),
+                                                dist.get(e[1], far)))
+        steps = collections.deque()
+        steps.extend((self._draw_queued_node, (layout[n], n)) for n in nodes)
+        steps.extend((self._draw_queued_edge, e) for e in edges)
+
+        # view is the scale, dx, dy the view has been transformed by (see
+        #  _transform_render) since the plot was started
+        self._render_job = {'steps': steps, 'total': len(steps),
+                            'finish': finish, 'after_id': None,
+                            'view': (1.0, 0.0, 0.0)}
+        self._render_chunk()
+
+    def _render_chunk(self):
+        """Draw the next render_budget ms worth of the progressive plot,
+        then let Tk handle events before drawing the next"""
+        job = self._render_job
+        if job is None:
+            return
+        job['after_id'] = None
+        steps = job['steps']
+        deadline = time.time() + self.render_budget/1000.0
+        with self._batched():
+            while steps:
+                draw, args = steps.popleft()
+                draw(*args)
+                if time.time() >= deadline:
+                    break
 
-            # Add edge to dispG and draw
-            self._draw_edge(n, m)
+        if not steps:
+            self._render_job = None
+            self.onRenderProgress(job['total'], job['total'])
+            job['finish']()
+            return
 
-        self._graph_changed()
+        if self.virtual:
+            self._update_viewport()
+        self._apply_detail(force=True)
+        self.onRenderProgress(job['total'] - len(steps), job['total'])
+        job['after_id'] = self.after(1, self._render_chunk)
+
+    def _draw_queued_node(self, xy, data_node):
+        """_draw_node at xy, the position it had in the layout when the
+        progressive plot was started, moved along with any pans and zooms
+        since"""
+        s, dx, dy = self._render_job['view']
+        self._draw_node((xy[0]*s + dx, xy[1]*s + dy), data_node)
+
+    def _transform_render(self, scale, dx, dy):
+        """Scale the nodes still to be drawn by the progressive plot (if
+        any) about the canvas origin by scale, then move them by dx, dy, as
+        the view was"""
+        job = self._render_job
+        if job is not None:
+            s, tx, ty = job['view']
+            job['view'] = (s*scale, tx*scale + dx, ty*scale + dy)
+
+    def _draw_queued_edge(self, u, v):
+        """_draw_edge, unless u or v has been hidden since the progressive
+        plot was started"""
+        if u in self._data_to_disp and v in self._data_to_disp:
+            self._draw_edge(u, v)
+
+    def _finish_render(self):
+        """Draw the rest of the progressive plot now"""
+        job = self._render_job
+        if job is None:
+            return
+        if job['after_id'] is not None:
+            self.after_cancel(job['after_id'])
+        budget = self.render_budget
+        self.render_budget = float('inf')
+        try:
+            self._render_chunk()
+        finally:
+            self.render_budget = budget
+
+    def cancel_render(self):
+        """Stop drawing a progressive plot, keeping what's been drawn so
+        far"""
+        if self._stop_render():
+            self._graph_changed()
+
+    def _stop_render(self):
+        """Drop the progressive plot being drawn, if any.  Returns whether
+        there was one."""
+        job = self._render_job
+        if job is None:
+            return False
+        if job['after_id'] is not None:
+            self.after_cancel(job['after_id'])
+        self._render_job = None
+        self.delete('progress')
+        return True
+
+    def onRenderProgress(self, done, total):
+        """Called as a progressive plot is drawn, with how many of its total
+        nodes and edges are drawn.  By default shows the percentage done in
+        the corner of the canvas.  Overwrite to show it elsewhere."""
+        if done >= total:
+            self.delete('progress')
+            return
+        text = 'Drawing... %d%%' % (100*done//total)
+        if self.find_withtag('progress'):
+            self.itemconfig('progress', text=text)
+            self.tag_raise('progress')
+        else:
+            self.create_text(8, 8, text=text, anchor=tk.NW, tags='progress')
+
+    def _mapped_layout(self, G, scale=None, fixed=None):
+        """Layout of G looked up from coordinate_map.  With scale, the nodes
+        are fit in a scale x scale box.  With fixed (positions of nodes
+        already on the canvas), the map is aligned to those nodes, which keep
+        their positions.  Nodes missing from the map are laid out around the
+        others with create_layout.  Returns None if the map can't place G."""
+        import numpy as np
+
+        nodes = list(G)
+        pos, found = self.coordinate_map.lookup(nodes)
+        # Scale to use if there's nothing to fit it to
+        s = self._map_scale
+        if s is None:
+            s = self._default_k(len(G)) / self.coordinate_map.spacing
+        if fixed:
+            anchors = [i for i in np.flatnonzero(found) if nodes[i] in fixed]
+            if not anchors:
+                return None
+            # Align the map to the canvas (which may have been panned,
+            #  zoomed or dragged since we plotted) by a least squares fit
+            #  of canvas = s*map + t
+            M = pos[anchors]
+            S = np.array([fixed[nodes[i]] for i in anchors], dtype='float64')
+            dM = M - M.mean(axis=0)
+            var = (dM**2).sum()
+            if var > 0:
+                fit = (dM*(S - S.mean(axis=0))).sum() / var
+                if fit > 0:
+                    s = fit
+            t = S.mean(axis=0) - s*M.mean(axis=0)
+        else:
+            if not found.any():
+                return None
+            lo = pos[found].min(axis=0)
+            if scale is not None:
+                span = (pos[found].max(axis=0) - lo).max()
+                s = scale/span if span > 0 else 1.0
+            t = -lo*s
+        self._map_scale = s
+
+        layout = {}
+        for i in np.flatnonzero(found):
+            layout[nodes[i]] = pos[i]*s + t
+        if fixed:
+            for n, xy in fixed.items():
+                if n in G:
+                    layout[n] = np.asarray(xy, dtype='float64')
+
+        if len(layout) < len(nodes):
+            # Nodes added to the data graph since the map was computed
+            layout = self.create_layout(G, pos=layout, fixed=list(layout))
+        return layout
+
+    def _initial_positions(self, G, pos=None, seed=None):
+        """Random starting positions for the nodes of G which are not in pos,
+        drawn from the same domain create_layout would use"""
+        import numpy as np
+
+        rng = np.random.RandomState(seed)
+
+        if pos:
+            dom_size = max(flatten(pos.values()))
+        else:
+            pos = {}
+            dom_size = 1.0
+        ans = {}
+        for n in G:
+            if n in pos:
+                ans[n] = np.asarray(pos[n], dtype='float64')
+            else:
+                ans[n] = rng.random_sample(2)*dom_size
+        return ans
+
+    def _rescale_positions(self, pos, scale):
+        """Rescale a dictionary of positions the way create_layout rescales
+        layouts which have no fixed nodes"""
+        import numpy as np
+
+        nodes = list(pos)
+        arr = nx.layout.rescale_layout(np.array([pos[n] for n in nodes]),
+                                       scale=scale)
+        return dict(zip(nodes, arr))
+
+    def _start_layout(self, G, offset=0, **kwargs):
+        """Run create_layout(G, **kwargs) in a worker thread.  Intermediate
+        positions are streamed back through a queue which the Tk thread polls
+        (see _poll_layout), so the nodes animate toward their final layout
+        while the UI stays responsive.  offset is added to every position,
+        as _plot_graph does.  Use cancel_layout to stop early."""
+        self.cancel_layout()
+
+        if kwargs.get('fixed') is not None and kwargs.get('k') is None:
+            # Tk must only be queried from this thread
+            kwargs['k'] = self._default_k(len(G))
+
+        cancel = threading.Event()
+        frames = queue.Queue()
+
+        def _callback(layout):
+            frames.put(('frame', layout))
+            return not cancel.is_set()
+
+        def _worker():
+            try:
+                layout = self.create_layout(G, callback=_callback, **kwargs)
+            except Exception as e:
+                frames.put(('error', e))
+            else:
+                frames.put(('done', layout))
+
+        # Track a displayed node (and where it is in the layout) so that if
+        #  the view is panned, centered or zoomed while the layout runs, the
+        #  new positions follow it
+        anchor = None
+        for n in G:
+            if n in self._data_to_disp:
+                anchor = (n, self._node_xy(self._data_to_disp[n]))
+                break
+
+        self._layout_job = {'cancel': cancel, 'frames': frames,
+                            'offset': offset, 'anchor': anchor,
+                            'shift': (0, 0), 'scale': self._view_scale}
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+        self._layout_job['after_id'] = self.after(self.layout_poll_interval,
+                                                  self._poll_layout)
+
+    def _poll_layout(self):
+        """Move nodes to the newest positions from the background layout"""
+        job = self._layout_job
+        if job is None:
+            return
+
+        latest = None
+        done = False
+        try:
+            while not done:
+                kind, value = job['frames'].get_nowait()
+                if kind == 'error':
+                    self._layout_job = None
+                    tkm.showerror("Layout Failed", str(value))
+                    return
+                latest = value
+                done = (kind == 'done')
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            self._move_to_layout(latest, job)
+
+        if done:
+            self._layout_job = None
+        else:
+            job['after_id'] = self.after(self.layout_poll_interval,
+                                         self._poll_layout)
+
+    def _move_to_layout(self, layout, job):
+        """Move displayed nodes to the positions in layout (keyed by data
+        node) and redraw their edges"""
+        offset = job['offset']
+        # Layout positions are zoomed by how far the view has been since
+        #  the layout started, then shifted by sx, sy
+        scale = self._view_scale / job['scale']
+        sx, sy = job['shift']
+        anchor = job['anchor']
+        if anchor is not None and anchor[0] in self._data_to_disp:
+            # Follow wherever the view has moved the anchor since the last
+            #  frame
+            x, y = self._node_xy(self._data_to_disp[anchor[0]])
+            sx = x - anchor[1][0]*scale
+            sy = y - anchor[1][1]*scale
+
+        moved = []
+        for n, xy in layout.items():
+            disp_node = self._data_to_disp.get(n)
+            if disp_node is None or disp_node == self._drag_data['item']:
+                # Hidden since the layout started, or being dragged
+                continue
+            self._place_node(disp_node, (xy[0]+offset)*scale + sx,
+                             (xy[1]+offset)*scale + sy)
+            moved.append(disp_node)
+
+        if moved:
+            n = self._disp_to_data[moved[0]]
+            job['anchor'] = (n, (layout[n][0]+offset, layout[n][1]+offset))
+        job['shift'] = (sx, sy)
+        self._redraw_edges(self.dispG.edges(moved, data=True))
+        if self.virtual:
+            self._update_viewport()
+
+    def cancel_layout(self):
+        """Stop any background layout, leaving nodes where they are now"""
+        job = self._layout_job
+        if job is None:
+            return
+        job['cancel'].set()
+        self.after_cancel(job['after_id'])
+        self._layout_job = None
 
 
     def _graph_changed(self):
@@ -981,26 +2176,41 @@ class GraphCanvas(tk.Canvas):
         Called every time a node or edge has been added or removed from
         the display graph.  Used to propagate completeness indicators
         down to the node's tokens"""
+        if self._batch_depth:
+            # Once, at the end of the batch
+            self._batch_changed = True
+            return
+
+        if self.virtual:
+            self._update_viewport()
 
+        # Only tell new tokens, and ones whose status has changed, so a
+        #  small change to a big display stays cheap
+        new_nodes, self._new_nodes = self._new_nodes, set()
         for n, d in self.dispG.nodes(data=True):
             token = d['token']
-            if self.dispG.degree(n) == self.dataG.degree(d['dataG_id']):
+            complete = (self.dispG.degree(n) ==
+                        self.dataG.degree(d['dataG_id']))
+            if complete == token.is_complete and n not in new_nodes:
+                continue
+            if complete:
                 token.mark_complete()
             else:
                 token.mark_incomplete()
 
+        # Draw new nodes and edges at the current level of detail
+        self._apply_detail(force=True)
+
 
     def _find_disp_node(self, data_node):
         """Given a node's name in self.dataG, find in self.dispG"""
-        disp_node = [a for a, d in self.dispG.nodes(data=True)
-                    if d['dataG_id'] == data_node]
-        if len(disp_node) == 0 and str(data_node).isdigit():
+        disp_node = self._data_to_disp.get(data_node)
+        if disp_node is None and str(data_node).isdigit():
             # Try again, this time using the int version
             data_node = int(data_node)
-            disp_node = [a for a, d in self.dispG.nodes(data=True)
-                    if d['dataG_id'] == data_node]
+            disp_node = self._data_to_disp.get(data_node)
 
-        if len(disp_node) == 0:
+        if disp_node is None:
             # It could be that this node is not displayed because it is
             #  currently being filtered out.  Test for that and, if true,
             #  raise a NodeFiltered exception
@@ -1017,13 +2227,11 @@ class GraphCanvas(tk.Canvas):
                     raise NodeFiltered
             raise ValueError("Data Node '%s' is not currently displayed"%\
                                 data_node)
-        elif len(disp_node) != 1:
-            raise AssertionError("Data node '%s' is displayed multiple "
-                                    "times" % data_node)
-        return disp_node[0]
+        return disp_node
 
     def create_layout(self, G, pos=None, fixed=None, scale=1.0,
-                      min_distance=None):
+                      min_distance=None, engine=None, k=None, callback=None,
+                      seed=None, refresh_cache=False):
         """Position nodes using Fruchterman-Reingold force-directed algorithm.
 
         Parameters
@@ -1035,7 +2243,8 @@ class GraphCanvas(tk.Canvas):
 
         k : float (default=None)
            Optimal distance between nodes.  If None the distance is set to
-           1/sqrt(n) where n is the number of nodes.  Increase this value
+           1/sqrt(n) where n is the number of nodes, or from the window
+           size (see _default_k) when fixed is passed.  Increase this value
            to move nodes farther apart.
 
 
@@ -1062,6 +2271,29 @@ class GraphCanvas(tk.Canvas):
             Minimum distance to enforce between nodes.  If passed with scale,
             this may cause the returned positions to go outside the scale.
 
+        engine : string or None   optional (default=None)
+            Force-directed engine to use, 'fruchterman_reingold',
+            'barnes_hut' or 'multilevel'.  If None, use the canvas's
+            layout_engine, or 'multilevel' if G has more than
+            multilevel_threshold nodes.
+
+        callback : function or None   optional (default=None)
+            Called after every iteration with a dictionary of the current
+            (rescaled, but not min_distance adjusted) positions keyed by
+            node.  If it returns False, the layout stops early and the
+            current positions are used.  Called from whatever thread
+            create_layout is running in.  Not called when the components
+            of G are laid out separately (see component_layout).
+
+        seed : int or None   optional (default=None)
+            Seed for the random initial positions.  If None and the
+            layout cache is enabled, a seed derived from the cache key is
+            used so the same graph always gets the same layout.
+
+        refresh_cache : bool   optional (default=False)
+            Compute a new layout from a fresh random seed even if one is
+            cached, and cache the result in its place.
+
         Returns
         -------
         dict :
@@ -1081,11 +2313,36 @@ class GraphCanvas(tk.Canvas):
         #  modification to what the optimal "k" is and the removal of
         #  the resize when fixed is passed
         dim = 2
+        requested_engine = engine
+        engine = self._resolve_engine(G, engine)
 
         try:
             import numpy as np
         except ImportError:
             raise ImportError("fruchterman_reingold_layout() requires numpy: http://scipy.org/ ")
+
+        if len(G)==0:
+            return {}
+        if len(G)==1:
+            return {G.nodes()[0]:(1,)*dim}
+
+        if k is None and fixed is not None:
+            k = self._default_k(len(G))
+
+        # Reuse a cached layout if we have one; otherwise seed from the
+        #  cache key so the same graph always gets the same layout
+        cache_key = None
+        if self.layout_cache is not None:
+            cache_key = self._layout_cache_key(G, pos, fixed, scale,
+                                               min_distance, engine, k)
+            if not refresh_cache:
+                ans = self.layout_cache.get(cache_key)
+                if ans is not None:
+                    return ans
+                if seed is None:
+                    seed = LayoutCache.seed(cache_key)
+        rng = np.random.RandomState(seed)
+
         if fixed is not None:
             nfixed=dict(zip(G,range(len(G))))
             fixed=np.asarray([nfixed[v] for v in fixed])
@@ -1093,7 +2350,7 @@ class GraphCanvas(tk.Canvas):
         if pos is not None:
             # Determine size of exisiting domain
             dom_size = max(flatten(pos.values()))
-            pos_arr=np.asarray(np.random.random((len(G),dim)))*dom_size
+            pos_arr=np.asarray(rng.random_sample((len(G),dim)))*dom_size
             for i,n in enumerate(G):
                 if n in pos:
                     pos_arr[i]=np.asarray(pos[n])
@@ -1101,22 +2358,44 @@ class GraphCanvas(tk.Canvas):
             pos_arr=None
             dom_size = 1.0
 
-        if len(G)==0:
-            return {}
-        if len(G)==1:
-            return {G.nodes()[0]:(1,)*dim}
-
-        A=nx.adjacency_matrix(G).todense()
+        # Keep the adjacency sparse; the engines work from its edge arrays
+        A=nx.adjacency_matrix(G)
         nnodes,_ = A.shape
-        # I've found you want to occupy about a two-thirds of the window size
-        if fixed is not None:
-            k=(min(self.winfo_width(), self.winfo_height())*.66)/np.sqrt(nnodes)
+
+        # Layouts which were stopped early are not cached
+        stopped = []
+        if callback is not None:
+            # Report positions the same way we return them
+            nodes = list(G)
+            def engine_callback(p):
+                if fixed is None:
+                    p = nx.layout.rescale_layout(p.copy(), scale=scale)
+                if callback(dict(zip(nodes, p))) is False:
+                    stopped.append(True)
+                    return False
         else:
-            k = None
+            engine_callback = None
+
+        components = None
+        if self.component_layout and fixed is None:
+            if G.is_directed():
+                components = list(nx.weakly_connected_components(G))
+            else:
+                components = list(nx.connected_components(G))
 
         # Alternate k, for when vieweing the whole graph, not a subset
         #k=dom_size/np.sqrt(nnodes)
-        pos=self._fruchterman_reingold(A,dim,k,pos_arr,fixed)
+        if components is not None and len(components) > 1:
+            pos=self._component_layout(G, components, requested_engine, rng)
+        elif engine == 'barnes_hut':
+            pos=self._barnes_hut(A,dim,k,pos_arr,fixed,
+                                 callback=engine_callback, rng=rng)
+        elif engine == 'multilevel':
+            pos=self._multilevel(A,dim,k,pos_arr,fixed,
+                                 callback=engine_callback, rng=rng)
+        else:
+            pos=self._fruchterman_reingold(A,dim,k,pos_arr,fixed,
+                                           callback=engine_callback, rng=rng)
 
         if fixed is None:
             # Only rescale non fixed layouts
@@ -1125,16 +2404,7 @@ class GraphCanvas(tk.Canvas):
         if min_distance and fixed is None:
             # Find min distance between any two nodes and scale such that
             #  this distance = min_distance
-
-            # matrix of difference between points
-            delta = np.zeros((pos.shape[0],pos.shape[0],pos.shape[1]),
-                             dtype=A.dtype)
-            for i in range(pos.shape[1]):
-                delta[:,:,i]= pos[:,i,None]-pos[:,i]
-            # distance between points
-            distance=np.sqrt((delta**2).sum(axis=-1))
-
-            cur_min_dist = np.where(distance==0, np.inf, distance).min()
+            cur_min_dist = _closest_distance(pos)
 
             if cur_min_dist < min_distance:
                 # calculate scaling factor and rescale
@@ -1142,12 +2412,144 @@ class GraphCanvas(tk.Canvas):
 
                 pos = nx.layout.rescale_layout(pos, scale=rescale)
 
-        return dict(zip(G,pos))
+        ans = dict(zip(G,pos))
+        if cache_key is not None and not stopped:
+            self.layout_cache.put(cache_key, ans)
+        return ans
+
+    def _resolve_engine(self, G, engine=None):
+        """Name of the layout engine create_layout will use for G"""
+        if engine is None:
+            engine = self.layout_engine
+            if (self.multilevel_threshold is not None and
+                    len(G) > self.multilevel_threshold):
+                engine = 'multilevel'
+        if engine not in self._layout_engines:
+            raise ValueError("Unknown layout engine '%s'" % engine)
+        return engine
+
+    def _layout_cache_key(self, G, pos=None, fixed=None, scale=1.0,
+                          min_distance=None, engine=None, k=None):
+        """Key of create_layout's result in layout_cache.  Free nodes start
+        at random positions anyway, so only the positions of fixed nodes
+        are part of the key."""
+        engine = self._resolve_engine(G, engine)
+        fixed_pos = None
+        components = bool(self.component_layout and fixed is None)
+        if fixed is not None:
+            if k is None:
+                k = self._default_k(len(G))
+            fixed_pos = sorted((repr(n), tuple(round(float(x), 1)
+                                               for x in pos[n]))
+                               for n in fixed)
+        return LayoutCache.make_key(G, engine=engine, scale=scale,
+                                    min_distance=min_distance,
+                                    k=None if k is None else round(k, 3),
+                                    fixed=fixed_pos, components=components)
+
+    def _component_layout(self, G, components, engine=None, rng=None):
+        """Lay out each of the connected components of G (a list of node
+        sets) on its own and pack them side by side.  Large components are
+        laid out in parallel in worker processes.  Returns an array of
+        positions in the order of G's nodes."""
+        import numpy as np
+
+        if rng is None:
+            rng = np.random
+        # Biggest first, so the slowest layouts start first
+        components = sorted((list(c) for c in components), key=len,
+                            reverse=True)
+        seeds = rng.randint(2**31, size=len(components))
+
+        results = [None]*len(components)
+        futures = {}
+        for i, nodes in enumerate(components):
+            if len(nodes) == 1:
+                results[i] = np.zeros((1, 2))
+                continue
+            A = nx.adjacency_matrix(G, nodelist=nodes)
+            args = (A, self._resolve_engine(nodes, engine), seeds[i])
+            pool = None
+            if len(nodes) >= self.component_pool_min_size:
+                pool = self._get_layout_pool()
+            if pool is not None:
+                futures[i] = pool.submit(_layout_component, *args)
+            else:
+                results[i] = _layout_component(*args)
+        for i, future in futures.items():
+            results[i] = future.result()
+
+        # The engines don't agree on a scale, so give every component the
+        #  same density: a box with sides of about sqrt(n) for n nodes
+        sizes = np.zeros((len(components), 2))
+        for i, p in enumerate(results):
+            p = p - p.min(axis=0)
+            extent = p.max()
+            if extent > 0:
+                p *= np.sqrt(len(p)) / extent
+            results[i] = p
+            sizes[i] = p.max(axis=0)
+        corners = _pack_rectangles(sizes, padding=1.0)
+
+        index = dict(zip(G, range(len(G))))
+        pos = np.zeros((len(G), 2))
+        for nodes, p, corner in zip(components, results, corners):
+            pos[[index[n] for n in nodes]] = p + corner
+        return pos
+
+    def _get_layout_pool(self):
+        """Process pool for _component_layout, or None if there is only one
+        process to lay out in"""
+        processes = self.layout_processes or os.cpu_count() or 1
+        if processes < 2:
+            return None
+        if self._layout_pool is None:
+            import concurrent.futures
+            # Forking a process with Tk (and maybe a layout thread) running
+            #  can deadlock or share its X connection; start fresh ones
+            self._layout_pool = concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('spawn'))
+        return self._layout_pool
+
+    def destroy(self):
+        self._stop_render()
+        self._undo_states.clear()
+        self._redo_states.clear()
+        if self._redraw_id is not None:
+            self.after_cancel(self._redraw_id)
+            self._redraw_id = None
+        if self._layout_pool is not None:
+            self._layout_pool.shutdown(wait=False)
+            self._layout_pool = None
+        tk.Canvas.destroy(self)
+
+    def _cached_layout(self, G, refresh=False, **kwargs):
+        """Look up what create_layout(G, **kwargs) would return in the
+        layout cache.  Returns (layout, seed): layout is None if it isn't
+        cached, and seed is what create_layout would seed with."""
+        if self.layout_cache is None or len(G) < 2 or refresh:
+            return None, None
+        key = self._layout_cache_key(G, **kwargs)
+        return self.layout_cache.get(key), LayoutCache.seed(key)
+
+    def _default_k(self, nnodes):
+        """Optimal distance between nodes when laying out around fixed
+        nodes already on the canvas"""
+        # I've found you want to occupy about a two-thirds of the window size
+        return (min(self.winfo_width(), self.winfo_height())*.66)/nnodes**.5
 
-    def _fruchterman_reingold(self, A, dim=2, k=None, pos=None, fixed=None,
-                              iterations=50):
+    @staticmethod
+    def _fruchterman_reingold(A, dim=2, k=None, pos=None, fixed=None,
+                              iterations=50, callback=None, rng=None):
         # Position nodes in adjacency matrix A using Fruchterman-Reingold
         # Entry point for NetworkX graph is fruchterman_reingold_layout()
+        # If passed, callback is called with the positions after every
+        #  iteration; returning False stops the layout early.
+        # rng is the numpy RandomState random positions are drawn from
+        #  (default the global one).
+        # A is kept sparse: attraction is computed per edge and the
+        #  repulsion is summed in blocks of rows, so no V x V array (or the
+        #  V x V x 2 delta tensor) is ever built.
         try:
             import numpy as np
         except ImportError:
@@ -1159,13 +2561,14 @@ class GraphCanvas(tk.Canvas):
             raise nx.NetworkXError(
                 "fruchterman_reingold() takes an adjacency matrix as input")
 
-        A=np.asarray(A) # make sure we have an array instead of a matrix
+        rows, cols, weights = _edge_arrays(A)
 
+        if rng is None:
+            rng = np.random
         if pos is None:
             # random initial positions
-            pos=np.asarray(np.random.random((nnodes,dim)),dtype='float64')
+            pos=np.asarray(rng.random_sample((nnodes,dim)),dtype='float64')
         else:
-            # make sure positions are of same type as matrix
             pos=pos.astype('float64')
 
         # optimal distance between nodes
@@ -1178,26 +2581,16 @@ class GraphCanvas(tk.Canvas):
         # simple cooling scheme.
         # linearly step down by dt on each iteration so last iteration is size dt.
         dt=t/float(iterations+1)
-        delta = np.zeros((pos.shape[0],pos.shape[0],pos.shape[1]),dtype=A.dtype)
-        # the inscrutable (but fast) version
-        # this is still O(V^2)
-        # could use multilevel methods to speed this up significantly
+        # this is still O(V^2) for the repulsion; see _barnes_hut for the
+        #  O(V log V) approximation
         for iteration in range(iterations):
-            # matrix of difference between points
-            for i in range(pos.shape[1]):
-                delta[:,:,i]= pos[:,i,None]-pos[:,i]
-            # distance between points
-            distance=np.sqrt((delta**2).sum(axis=-1))
-            # enforce minimum distance of 0.01
-            distance=np.where(distance<0.01,0.01,distance)
             # displacement "force"
-            displacement=np.transpose(np.transpose(delta)*\
-                                      (k*k/distance**2-A*distance/k))\
-                                      .sum(axis=1)
+            displacement = _exact_repulsion(pos, k*k)
+            displacement -= _edge_attraction(pos, rows, cols, weights, k)
             # update positions
             length=np.sqrt((displacement**2).sum(axis=1))
             length=np.where(length<0.01,0.1,length)
-            delta_pos=np.transpose(np.transpose(displacement)*t/length)
+            delta_pos=displacement*(t/length)[:,None]
             if fixed is not None:
                 # don't change positions of fixed nodes
                 delta_pos[fixed]=0.0
@@ -1206,11 +2599,525 @@ class GraphCanvas(tk.Canvas):
             # cool temperature
             t-=dt
             ###pos=_rescale_layout(pos)
+            if callback is not None and callback(pos) is False:
+                break
         return pos
 
+    @staticmethod
+    def _barnes_hut(A, dim=2, k=None, pos=None, fixed=None,
+                    iterations=50, leaf_size=4, t=None, callback=None,
+                    rng=None):
+        # Position nodes in adjacency matrix A using Fruchterman-Reingold
+        #  forces, approximating the repulsion with a Barnes-Hut quadtree.
+        #  Attraction is computed per edge, so each iteration is
+        #  O(V log V + E) instead of O(V^2).
+        # Uses the same pos/fixed/k semantics and cooling scheme as
+        #  _fruchterman_reingold, including callback.  t is the initial
+        #  temperature (largest step allowed); by default .1 of the domain
+        #  size
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("_barnes_hut() requires numpy: http://scipy.org/ ")
+
+        if dim != 2:
+            raise ValueError("_barnes_hut() only supports 2D layouts")
+
+        try:
+            nnodes,_=A.shape
+        except AttributeError:
+            raise nx.NetworkXError(
+                "_barnes_hut() takes an adjacency matrix as input")
+
+        rows, cols, weights = _edge_arrays(A)
+
+        if rng is None:
+            rng = np.random
+        if pos is None:
+            # random initial positions
+            pos=np.asarray(rng.random_sample((nnodes,dim)),dtype='float64')
+        else:
+            pos=pos.astype('float64')
+
+        # optimal distance between nodes
+        if k is None:
+            k=np.sqrt(1.0/nnodes)
+        # Same cooling scheme as _fruchterman_reingold
+        if t is None:
+            t = max(max(pos.T[0]) - min(pos.T[0]),
+                    max(pos.T[1]) - min(pos.T[1]))*0.1
+        dt=t/float(iterations+1)
+        for iteration in range(iterations):
+            # Repulsion from every other node, approximated by the quadtree
+            displacement = _quadtree_repulsion(pos, k*k, leaf_size)
+
+            # Attraction along edges only
+            displacement -= _edge_attraction(pos, rows, cols, weights, k)
+
+            # update positions
+            length=np.sqrt((displacement**2).sum(axis=1))
+            length=np.where(length<0.01,0.1,length)
+            delta_pos=displacement*(t/length)[:,None]
+            if fixed is not None:
+                # don't change positions of fixed nodes
+                delta_pos[fixed]=0.0
+
+            pos+=delta_pos
+            # cool temperature
+            t-=dt
+            if callback is not None and callback(pos) is False:
+                break
+        return pos
+
+    @staticmethod
+    def _multilevel(A, dim=2, k=None, pos=None, fixed=None,
+                    iterations=50, refine_iterations=5, coarsest_size=100,
+                    callback=None, rng=None):
+        # Multilevel Fruchterman-Reingold.  Repeatedly coarsen the graph by
+        #  collapsing a matching of its edges, lay out the coarsest graph
+        #  with _barnes_hut, then project the positions back down one level
+        #  at a time, running a few low temperature refinement iterations
+        #  at each level.  Fixed nodes are never collapsed, so they stay put.
+        # callback and rng are as in _fruchterman_reingold; callback is
+        #  always given positions for the nodes of A (coarse positions are
+        #  projected).
+        try:
+            import numpy as np
+            import scipy.sparse as sp
+        except ImportError:
+            raise ImportError("_multilevel() requires numpy and scipy: http://scipy.org/ ")
+
+        try:
+            nnodes,_=A.shape
+        except AttributeError:
+            raise nx.NetworkXError(
+                "_multilevel() takes an adjacency matrix as input")
+
+        if rng is None:
+            rng = np.random
+        if pos is None:
+            # random initial positions
+            pos=np.asarray(rng.random_sample((nnodes,dim)),dtype='float64')
+        else:
+            pos=pos.astype('float64')
+        fixed_mask = np.zeros(nnodes, dtype=bool)
+        if fixed is not None:
+            fixed_mask[fixed] = True
+
+        # optimal distance between nodes; grows as sqrt(nnodes / level size)
+        #  as the levels get coarser
+        if k is None:
+            k=np.sqrt(1.0/nnodes)
+
+        # Coarsen.  Each level is (adjacency, fixed_mask, positions) and
+        #  groups[i] maps the nodes of levels[i] onto those of levels[i+1]
+        G = sp.csr_matrix(A, dtype='float64')
+        levels = [(G + G.T, fixed_mask, pos)]
+        groups = []
+        while levels[-1][0].shape[0] > coarsest_size:
+            A_l, fixed_l, pos_l = levels[-1]
+            n_l = A_l.shape[0]
+            group, n_c = _match_nodes(A_l, fixed_l, rng)
+            if n_c > 0.8*n_l:
+                # Matching no longer shrinks the graph meaningfully
+                break
+            P = sp.csr_matrix((np.ones(n_l), (np.arange(n_l), group)),
+                              shape=(n_l, n_c))
+            A_c = (P.T @ A_l @ P).tocsr()
+            A_c.setdiag(0)
+            A_c.eliminate_zeros()
+            A_c.data[:] = 1.0   # Coarse levels only need the topology
+            size = np.bincount(group, minlength=n_c)
+            pos_c = np.column_stack([
+                np.bincount(group, weights=pos_l[:,i], minlength=n_c)/size
+                for i in range(dim)])
+            fixed_c = np.bincount(group, weights=fixed_l, minlength=n_c) > 0
+            groups.append(group)
+            levels.append((A_c, fixed_c, pos_c))
+
+        # Map from the nodes of A to the nodes of each level, so that
+        #  callback can always be given positions for every node of A
+        to_level = [np.arange(nnodes)]
+        for group in groups:
+            to_level.append(group[to_level[-1]])
+        stopped = []
+        def _level_callback(i):
+            if callback is None:
+                return None
+            def _callback(p):
+                if callback(p[to_level[i]]) is False:
+                    stopped.append(True)
+                    return False
+            return _callback
+
+        # Lay out the coarsest level (the original A if we never coarsened)
+        A_c, fixed_c, pos_c = levels[-1]
+        if len(levels) == 1:
+            A_c = A
+        k_c = k*np.sqrt(nnodes/float(A_c.shape[0]))
+        pos_c = GraphCanvas._barnes_hut(A_c, dim, k_c, pos_c,
+                                        np.flatnonzero(fixed_c),
+                                        iterations=iterations,
+                                        callback=_level_callback(len(groups)))
+
+        # Project back down, refining each level
+        for i in range(len(groups)-1, -1, -1):
+            if stopped:
+                return pos_c[to_level[i+1]]
+            A_l, fixed_l, pos_l = levels[i]
+            if i == 0:
+                A_l = A
+            n_l = A_l.shape[0]
+            k_l = k*np.sqrt(nnodes/float(n_l))
+            # Jitter so that nodes collapsed together can separate
+            pos_f = pos_c[groups[i]] + \
+                    (rng.random_sample((n_l,dim))-0.5)*k_l*0.1
+            pos_f[fixed_l] = pos_l[fixed_l]
+            pos_c = GraphCanvas._barnes_hut(A_l, dim, k_l, pos_f,
+                                            np.flatnonzero(fixed_l),
+                                            iterations=refine_iterations,
+                                            t=k_l,
+                                            callback=_level_callback(i))
+        return pos_c
+
 class NodeFiltered(Exception):
     pass
 
+def _edge_arrays(A):
+    """Return (rows, cols, weights) arrays for the nonzero entries of
+    adjacency matrix A, which may be a scipy sparse matrix or dense"""
+    import numpy as np
+
+    if hasattr(A, 'tocoo'):
+        A = A.tocoo()
+        rows, cols, weights = A.row, A.col, A.data
+    else:
+        A = np.asarray(A)
+        rows, cols = np.nonzero(A)
+        weights = A[rows, cols]
+    return (np.asarray(rows, dtype='int64'), np.asarray(cols, dtype='int64'),
+            np.asarray(weights, dtype='float64'))
+
+def _edge_attraction(pos, rows, cols, weights, k):
+    """Fruchterman-Reingold attractive displacement (sum over edges (i,j) of
+    A_ij * delta_ij * distance_ij / k) for every node in pos"""
+    import numpy as np
+
+    delta = pos[rows] - pos[cols]
+    distance = np.sqrt((delta**2).sum(axis=1))
+    # enforce minimum distance of 0.01
+    distance = np.where(distance<0.01,0.01,distance)
+    attraction = delta * (weights*distance/k)[:,None]
+
+    ans = np.empty_like(pos)
+    for i in range(pos.shape[1]):
+        ans[:,i] = np.bincount(rows, weights=attraction[:,i],
+                               minlength=len(pos))
+    return ans
+
+def _exact_repulsion(pos, k2, block_size=2**20):
+    """Fruchterman-Reingold repulsive displacement (sum over j of
+    delta_ij * k2 / distance_ij**2) for every node in pos.  Rows are
+    processed in blocks so at most block_size pairs are held in memory."""
+    import numpy as np
+
+    nnodes = len(pos)
+    displacement = np.empty_like(pos)
+    step = max(1, block_size // max(nnodes, 1))
+    for start in range(0, nnodes, step):
+        block = slice(start, start+step)
+        delta = [pos[block,i,None] - pos[:,i] for i in range(pos.shape[1])]
+        distance2 = sum(d*d for d in delta)
+        np.maximum(distance2, 1e-4, out=distance2)
+        factor = k2/distance2
+        for i, d in enumerate(delta):
+            displacement[block,i] = (d*factor).sum(axis=1)
+    return displacement
+
+def _closest_distance(pos, block_size=2**20):
+    """Smallest non-zero distance between any two of the 2D points in pos
+    (inf if there is none).
+
+    Points are bucketed in a uniform grid of about one point per cell and
+    only points in neighboring cells are compared.  If that doesn't find a
+    pair closer than the cell size, the cells are doubled and we try again.
+    For a layout this is O(V) time and memory instead of comparing all
+    V^2 pairs."""
+    import numpy as np
+
+    nnodes = len(pos)
+    lo = pos.min(axis=0)
+    span = pos.max(axis=0) - lo
+    extent = span.max()
+    if nnodes < 2 or extent == 0:
+        return np.inf
+
+    x = pos[:,0]
+    y = pos[:,1]
+    nodes = np.arange(nnodes)
+    # Cell size for about one point per cell, even if the points are on a
+    #  line
+    h = max(np.sqrt(span[0]*span[1]/nnodes), extent/nnodes)
+    while True:
+        cell = np.floor((pos - lo) / h).astype('int64')
+        size_x, size_y = cell.max(axis=0) + 1
+        ids = cell[:,0]*size_y + cell[:,1]
+        order = np.argsort(ids, kind='stable')
+        counts = np.bincount(ids, minlength=size_x*size_y)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        best = np.inf
+        for ox in (-1, 0, 1):
+            nx_ = cell[:,0] + ox
+            for oy in (-1, 0, 1):
+                ny_ = cell[:,1] + oy
+                ok = (nx_ >= 0) & (nx_ < size_x) & (ny_ >= 0) & (ny_ < size_y)
+                nb = np.where(ok, nx_*size_y + ny_, 0)
+                cnt = np.where(ok, counts[nb], 0)
+                ends = np.cumsum(cnt)
+                chunk_start = 0
+                while chunk_start < nnodes:
+                    # Take as many points as fit in about block_size pairs
+                    chunk_end = np.searchsorted(
+                        ends, ends[chunk_start] - cnt[chunk_start] + block_size,
+                        'right')
+                    chunk_end = max(chunk_end, chunk_start + 1)
+                    chunk = slice(chunk_start, chunk_end)
+                    c = cnt[chunk]
+                    i = np.repeat(nodes[chunk], c)
+                    within = np.arange(len(i)) - np.repeat(np.cumsum(c) - c, c)
+                    j = order[np.repeat(starts[nb[chunk]], c) + within]
+                    dx = x[i] - x[j]
+                    dy = y[i] - y[j]
+                    d2 = dx*dx + dy*dy
+                    # Ignore a point paired with itself (or one on top of it)
+                    d2 = d2[d2 > 0]
+                    if len(d2):
+                        best = min(best, d2.min())
+                    chunk_start = chunk_end
+
+        best = np.sqrt(best)
+        if best <= h or h >= extent:
+            # Any closer pair would have been in neighboring cells
+            return best
+        h *= 2
+
+def _layout_component(A, engine, seed):
+    """Lay out the connected graph with sparse adjacency matrix A using
+    engine (the name of one of GraphCanvas's engines).  Module level so it
+    can be run in a worker process."""
+    import numpy as np
+
+    layout = getattr(GraphCanvas, '_' + engine)
+    return layout(A, rng=np.random.RandomState(seed))
+
+def _pack_rectangles(sizes, padding=0.0):
+    """Place rectangles with the given (width, height) sizes side by side
+    in a roughly square area, leaving padding between them.  Rectangles are
+    placed on shelves in order of decreasing height.  Returns the lower left
+    corner of each rectangle."""
+    import numpy as np
+
+    sizes = np.asarray(sizes, dtype='float64') + padding
+    corners = np.zeros_like(sizes)
+    if len(sizes) == 0:
+        return corners
+    width = max(np.sqrt((sizes[:,0]*sizes[:,1]).sum()), sizes[:,0].max())
+
+    x = y = shelf_height = 0.0
+    for i in np.argsort(-sizes[:,1], kind='stable'):
+        w, h = sizes[i]
+        if x > 0 and x + w > width:
+            # Start a new shelf
+            y += shelf_height
+            x = shelf_height = 0.0
+        corners[i] = (x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return corners
+
+def _match_nodes(A, fixed_mask, rng=None):
+    """Greedy random matching of the nodes of symmetric sparse adjacency
+    matrix A, used to coarsen a graph.  Fixed nodes are left unmatched.
+    Returns (group, ngroups) where group[i] is the coarse node i maps to.
+    The matching order is drawn from numpy RandomState rng."""
+    import numpy as np
+
+    if rng is None:
+        rng = np.random
+
+    A = A.tocsr()
+    nnodes = A.shape[0]
+    indptr = A.indptr.tolist()
+    indices = A.indices.tolist()
+    fixed_mask = fixed_mask.tolist()
+
+    group = [-1]*nnodes
+    ngroups = 0
+    for u in rng.permutation(nnodes).tolist():
+        if group[u] >= 0:
+            continue
+        group[u] = ngroups
+        if not fixed_mask[u]:
+            for v in indices[indptr[u]:indptr[u+1]]:
+                if group[v] < 0 and not fixed_mask[v]:
+                    group[v] = ngroups
+                    break
+        ngroups += 1
+    return np.asarray(group, dtype='int64'), ngroups
+
+def _quadtree_repulsion(pos, k2, leaf_size=4):
+    """Approximate the Fruchterman-Reingold repulsive displacement
+    (sum over j of delta_ij * k2 / distance_ij**2) for every node in pos
+    using a Barnes-Hut quadtree.
+
+    The tree is stored level by level as dense grids of cell masses and
+    centers of mass.  At each level a node interacts with the cells that are
+    children of its parent's neighbors but are not its own neighbors (ie,
+    cells that are well separated from it); only nodes in neighboring leaf
+    cells are summed exactly.  Work is vectorized over the nodes, so the
+    cost is O(V log V)."""
+    import numpy as np
+
+    nnodes = len(pos)
+    x = pos[:,0]
+    y = pos[:,1]
+    disp_x = np.zeros(nnodes)
+    disp_y = np.zeros(nnodes)
+    if nnodes < 2:
+        return np.column_stack((disp_x, disp_y))
+
+    # Depth so that the leaves hold about leaf_size nodes each
+    depth = int(np.ceil(np.log(max(nnodes / float(leaf_size), 1)) / np.log(4)))
+    depth = min(max(depth, 0), 15)
+    size = 2**depth
+
+    lo = pos.min(axis=0)
+    span = (pos.max(axis=0) - lo).max()
+    if span == 0:
+        span = 1.0
+    cell = np.floor((pos - lo) / span * size).astype('int64')
+    cell = np.clip(cell, 0, size - 1)
+
+    def _add_force(other_x, other_y, mass):
+        # Nodes with nothing to interact with are passed a mass of 0
+        dx = x - other_x
+        dy = y - other_y
+        factor = dx*dx + dy*dy
+        np.maximum(factor, 1e-4, out=factor)
+        np.divide(k2 * mass, factor, out=factor)
+        np.add(disp_x, dx*factor, out=disp_x)
+        np.add(disp_y, dy*factor, out=disp_y)
+
+    # Far field: walk the levels of the tree
+    for level in range(2, depth+1):
+        n = 2**level
+        cx = cell[:,0] >> (depth - level)
+        cy = cell[:,1] >> (depth - level)
+        ids = cx*n + cy
+        mass = np.bincount(ids, minlength=n*n).astype('float64')
+        com_x = np.bincount(ids, weights=x, minlength=n*n)
+        com_y = np.bincount(ids, weights=y, minlength=n*n)
+        occupied = mass > 0
+        com_x[occupied] /= mass[occupied]
+        com_y[occupied] /= mass[occupied]
+
+        # Children of the parent's neighbors span [2*(c//2)-2, 2*(c//2)+3]
+        #  along each axis.  Work out which offsets are in range per axis
+        #  once, then combine them.
+        def _offsets(c):
+            p = 2*(c >> 1)
+            ans = {}
+            for o in range(-3, 4):
+                nc = c + o
+                ok = (nc >= p-2) & (nc <= p+3) & (nc >= 0) & (nc < n)
+                ans[o] = (np.clip(nc, 0, n-1), ok)
+            return ans
+        x_offsets = _offsets(cx)
+        y_offsets = _offsets(cy)
+        for ox, (nx_, ok_x) in x_offsets.items():
+            nx_ = nx_*n
+            for oy, (ny_, ok_y) in y_offsets.items():
+                if abs(ox) <= 1 and abs(oy) <= 1:
+                    # Neighbors are handled at a finer level
+                    continue
+                ok = ok_x & ok_y
+                if not ok.any():
+                    continue
+                nb = nx_ + ny_
+                _add_force(com_x[nb], com_y[nb], mass[nb]*ok)
+
+    # Near field: exact sum over every pair of nodes in neighboring leaf
+    #  cells.  Pairs are enumerated per neighbor offset and summed in chunks
+    #  so memory stays bounded when the leaves are crowded.
+    ids = cell[:,0]*size + cell[:,1]
+    order = np.argsort(ids, kind='stable')
+    counts = np.bincount(ids, minlength=size*size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    nodes = np.arange(nnodes)
+    for ox in (-1, 0, 1):
+        nx_ = cell[:,0] + ox
+        for oy in (-1, 0, 1):
+            ny_ = cell[:,1] + oy
+            ok = (nx_ >= 0) & (nx_ < size) & (ny_ >= 0) & (ny_ < size)
+            nb = np.where(ok, nx_*size + ny_, 0)
+            cnt = np.where(ok, counts[nb], 0)
+            ends = np.cumsum(cnt)
+            chunk_start = 0
+            while chunk_start < nnodes:
+                # Take as many nodes as fit in about 2**20 pairs
+                chunk_end = np.searchsorted(ends, ends[chunk_start] -
+                                            cnt[chunk_start] + 2**20, 'right')
+                chunk_end = max(chunk_end, chunk_start + 1)
+                chunk = slice(chunk_start, chunk_end)
+                c = cnt[chunk]
+                i = np.repeat(nodes[chunk], c)
+                # Position of each pair within its node's run of pairs
+                within = np.arange(len(i)) - np.repeat(np.cumsum(c) - c, c)
+                j = order[np.repeat(starts[nb[chunk]], c) + within]
+                # A node's contribution on itself is zero since delta is 0
+                dx = x[i] - x[j]
+                dy = y[i] - y[j]
+                factor = dx*dx + dy*dy
+                np.maximum(factor, 1e-4, out=factor)
+                np.divide(k2, factor, out=factor)
+                disp_x += np.bincount(i, weights=dx*factor, minlength=nnodes)
+                disp_y += np.bincount(i, weights=dy*factor, minlength=nnodes)
+                chunk_start = chunk_end
+
+    return np.column_stack((disp_x, disp_y))
+
+def _spline_coords(p1, p2, m):
+    """Vectorized GraphCanvas._spline_center: (E, 6) array of the x1, y1,
+    xa, ya, x2, y2 of splines from the rows of p1 to the rows of p2 (both
+    (E, 2) arrays), with midpoints extruded out m (length E) pixels"""
+    import numpy as np
+
+    a = (p2[:, 0] + p1[:, 0])/2
+    b = (p2[:, 1] + p1[:, 1])/2
+    beta = (np.pi/2) - np.arctan2(p2[:, 1]-p1[:, 1], p2[:, 0]-p1[:, 0])
+    xa = a - m*np.cos(beta)
+    ya = b + m*np.sin(beta)
+    return np.column_stack((p1, xa, ya, p2))
+
+def _hops(G, sources):
+    """Dict of how many hops each node of G is from the nearest of sources
+    (a breadth first search from all of them at once).  Nodes which can't
+    be reached are left out."""
+    dist = dict((s, 0) for s in sources if s in G)
+    frontier = list(dist)
+    hops = 0
+    while frontier:
+        hops += 1
+        next_frontier = []
+        for n in frontier:
+            for m in G.neighbors(n):
+                if m not in dist:
+                    dist[m] = hops
+                    next_frontier.append(m)
+        frontier = next_frontier
+    return dist
+
 def flatten(l):
     try:
         bs = basestring
@@ -0,0 +1,116 @@
+"""
+Cache of computed layouts so re-plotting a known set of nodes is instant and
+gives the same picture every time.
+"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+
+class LayoutCache(object):
+    """Least recently used cache of layouts, keyed by a hash of the graph
+    being laid out and the layout parameters (see make_key).
+
+    If directory is given, layouts are also written there so they persist
+    between sessions.  Files on disk are never evicted."""
+
+    def __init__(self, max_entries=32, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+        # Layouts may be computed in a background thread (see
+        #  GraphCanvas._start_layout)
+        self._lock = threading.Lock()
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def make_key(G, **params):
+        """Hash the nodes and edges of G together with the layout parameters.
+        Only reprs are hashed, so keys are stable between sessions."""
+        h = hashlib.sha1()
+        for n in sorted(repr(n) for n in G):
+            h.update(n.encode('utf-8'))
+            h.update(b'\0')
+        h.update(b'\1')
+
+        directed = G.is_directed()
+        edges = []
+        for u, v, d in G.edges(data=True):
+            u, v = repr(u), repr(v)
+            if not directed and v < u:
+                u, v = v, u
+            edges.append(repr((u, v, d.get('weight', 1))))
+        for e in sorted(edges):
+            h.update(e.encode('utf-8'))
+            h.update(b'\0')
+        h.update(b'\1')
+
+        for k in sorted(params):
+            h.update(repr((k, params[k])).encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def seed(key):
+        """Deterministic random seed for the layout with this key"""
+        return int(key[:8], 16)
+
+    def get(self, key):
+        """Return the layout stored under key, or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return dict(self._entries[key])
+
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                layout = pickle.load(f)
+        except (IOError, OSError, pickle.UnpicklingError, EOFError):
+            return None
+        self._remember(key, layout)
+        return dict(layout)
+
+    def put(self, key, layout):
+        """Store layout (dict of positions keyed by node) under key"""
+        layout = dict(layout)
+        self._remember(key, layout)
+
+        if self.directory is None:
+            return
+        # Write to a temp file first so a half written layout is never read
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(layout, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def clear(self):
+        """Forget all layouts held in memory"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (
+            self.directory is not None and os.path.exists(self._path(key)))
+
+    def _remember(self, key, layout):
+        with self._lock:
+            self._entries[key] = layout
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.layout')
@@ -0,0 +1,108 @@
+"""
+Positions of the nodes on a GraphCanvas, kept in python so the canvas never
+has to ask Tk where anything is.
+"""
+
+
+class NodePositions(object):
+    """(x, y) positions keyed by display node, stored as the rows of one
+    contiguous (N, 2) float array so whole-view operations (pan, zoom,
+    culling) are single NumPy expressions.
+
+    Rows are packed: removing a node moves the last row into its place, so
+    xy is always exactly the positions of the len(self) nodes, in the order
+    of the nodes attribute."""
+
+    def __init__(self, capacity=64):
+        import numpy as np
+
+        self._xy = np.zeros((capacity, 2))
+        self._rows = {}
+        self.nodes = []
+
+    @property
+    def xy(self):
+        """(N, 2) array of the positions of nodes.  A view: writing to it
+        moves the nodes."""
+        return self._xy[:len(self.nodes)]
+
+    def add(self, node, x, y):
+        """Add node at x, y (or move it there if it's already here)"""
+        if node in self._rows:
+            self[node] = (x, y)
+            return
+        n = len(self.nodes)
+        if n == len(self._xy):
+            self._grow(2*n or 64)
+        self._xy[n] = (x, y)
+        self._rows[node] = n
+        self.nodes.append(node)
+
+    def remove(self, node):
+        row = self._rows.pop(node)
+        last = self.nodes.pop()
+        if last != node:
+            # Fill the hole with the last row
+            self._xy[row] = self._xy[len(self.nodes)]
+            self.nodes[row] = last
+            self._rows[last] = row
+
+    def clear(self):
+        self._rows.clear()
+        del self.nodes[:]
+
+    def move(self, node, dx, dy):
+        row = self._rows[node]
+        self._xy[row, 0] += dx
+        self._xy[row, 1] += dy
+
+    def translate(self, dx, dy):
+        """Move every node by dx, dy"""
+        xy = self.xy
+        xy[:, 0] += dx
+        xy[:, 1] += dy
+
+    def scale(self, x, y, scale):
+        """Scale every node's distance from x, y by scale"""
+        xy = self.xy
+        xy[:, 0] = x + (xy[:, 0] - x)*scale
+        xy[:, 1] = y + (xy[:, 1] - y)*scale
+
+    def rows(self, nodes):
+        """Array of the rows of xy holding nodes"""
+        import numpy as np
+
+        return np.fromiter((self._rows[n] for n in nodes), dtype=np.intp,
+                           count=len(nodes))
+
+    def within(self, x0, y0, x1, y1):
+        """List of the nodes inside the rectangle x0, y0, x1, y1"""
+        import numpy as np
+
+        xy = self.xy
+        inside = ((xy[:, 0] >= x0) & (xy[:, 0] <= x1) &
+                  (xy[:, 1] >= y0) & (xy[:, 1] <= y1))
+        nodes = self.nodes
+        return [nodes[i] for i in np.flatnonzero(inside)]
+
+    def _grow(self, capacity):
+        import numpy as np
+
+        xy = np.zeros((capacity, 2))
+        xy[:len(self.nodes)] = self._xy[:len(self.nodes)]
+        self._xy = xy
+
+    def __getitem__(self, node):
+        return tuple(self._xy[self._rows[node]].tolist())
+
+    def __setitem__(self, node, xy):
+        self._xy[self._rows[node]] = xy
+
+    def __contains__(self, node):
+        return node in self._rows
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
@@ -0,0 +1,223 @@
+"""
+Compact, versioned file format for saving what a GraphCanvas is showing
+(see GraphCanvas.save_session).  Unlike dump_visualization, it doesn't
+pickle the display graph or its tokens, so it's small, quick to write and
+can be read by later versions of the viewer.
+
+A session file is MAGIC, a line of JSON header, then sections.  Each
+section is its name on a line of its own, followed by its contents as
+chunks, each prefixed by its length as a little endian uint32, ending with
+an empty chunk.  If the header's compression is 'zlib', the contents are
+zlib compressed.  Readers skip sections they don't know.
+
+Sections, in order:
+    - node_ids = JSON list of the data graph ids of the displayed nodes
+       (tuples are written as {"tuple": [...]})
+    - node_xy = float64 x, y canvas position of each node
+    - node_marked = Bitset (see numpy.packbits) of which nodes are marked
+    - edge_ends = uint32 indexes into node_ids of the ends of each edge,
+       from end first
+    - edge_keys = JSON list of the key of each edge among the edges between
+       its ends, written like node_ids
+    - edge_marked = Bitset of which edges are marked
+"""
+import json
+import numbers
+import struct
+import zlib
+
+MAGIC = b'NXVSESS\n'
+VERSION = 1
+
+# Most bytes to write (before compression) in one chunk
+CHUNK_SIZE = 2**20
+
+
+def write_session(f, node_ids, xy, node_marked, edge_ends, edge_keys,
+                  edge_marked, view_scale=1.0, compress=True):
+    """Write a session to the binary file f.  node_ids is a list of N
+    data graph node ids, edge_ends is E pairs of indexes into it and
+    edge_keys a list of E edge keys; the rest are arrays (or sequences) of
+    the matching length.  Arrays are written a chunk at a time without being
+    copied.  Raises ValueError if a node id or edge key can't be saved."""
+    import numpy as np
+
+    header = {
+        'version': VERSION,
+        'compression': 'zlib' if compress else None,
+        'nodes': len(node_ids),
+        'edges': len(edge_keys),
+        'view_scale': view_scale,
+    }
+    f.write(MAGIC)
+    f.write(json.dumps(header).encode('utf-8') + b'\n')
+
+    xy = np.asarray(xy, dtype='<f8').reshape(-1, 2)
+    edge_ends = np.asarray(edge_ends, dtype='<u4').reshape(-1, 2)
+    sections = [
+        ('node_ids', _json_chunks(node_ids)),
+        ('node_xy', _array_chunks(xy)),
+        ('node_marked', _array_chunks(_bitset(node_marked))),
+        ('edge_ends', _array_chunks(edge_ends)),
+        ('edge_keys', _json_chunks(edge_keys)),
+        ('edge_marked', _array_chunks(_bitset(edge_marked))),
+    ]
+    for name, chunks in sections:
+        _write_section(f, name, chunks, compress)
+
+
+def read_session(f):
+    """Read a session written by write_session from the binary file f.
+    Returns a dict of view_scale and the arrays write_session was passed
+    (node_ids as a list, the marks as bool arrays).  Raises ValueError if f
+    isn't a complete session file or was written by a newer version."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a networkx_viewer session file")
+    try:
+        header = json.loads(f.readline().decode('utf-8'))
+        version = header['version']
+        compressed = header['compression'] == 'zlib'
+        n = header['nodes']
+        e = header['edges']
+        view_scale = header['view_scale']
+    except (KeyError, TypeError) as err:
+        raise ValueError("Session file header is missing %s" % err)
+    if version > VERSION:
+        raise ValueError("Session file is version %d; this viewer only "
+                         "reads up to version %d" % (version, VERSION))
+
+    sections = {}
+    while True:
+        name = f.readline()
+        if not name:
+            break
+        sections[name.decode('utf-8').rstrip('\n')] = _read_section(
+            f, compressed)
+
+    try:
+        return _parse_sections(sections, n, e, view_scale)
+    except KeyError as err:
+        raise ValueError("Session file is missing section %s" % err)
+
+
+def _parse_sections(sections, n, e, view_scale):
+    import numpy as np
+
+    ans = {
+        'view_scale': view_scale,
+        'node_ids': _decode_ids(sections['node_ids']),
+        'node_xy': np.frombuffer(sections['node_xy'], '<f8').reshape(n, 2),
+        'node_marked': _unbitset(sections['node_marked'], n),
+        'edge_ends': np.frombuffer(sections['edge_ends'], '<u4').reshape(e, 2),
+        'edge_keys': _decode_ids(sections['edge_keys']),
+        'edge_marked': _unbitset(sections['edge_marked'], e),
+    }
+    # reshape has checked the arrays' sizes
+    if (len(ans['node_ids']) != n or len(ans['edge_keys']) != e or
+            len(ans['node_marked']) != n or len(ans['edge_marked']) != e or
+            (e and ans['edge_ends'].max() >= n)):
+        raise ValueError("Session file sections don't match")
+    return ans
+
+
+def _write_section(f, name, chunks, compress):
+    f.write(name.encode('utf-8') + b'\n')
+    compressor = zlib.compressobj() if compress else None
+    for chunk in chunks:
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        _write_chunk(f, chunk)
+    if compressor is not None:
+        _write_chunk(f, compressor.flush())
+    f.write(struct.pack('<I', 0))
+
+
+def _write_chunk(f, chunk):
+    # An empty chunk would end the section
+    if len(chunk):
+        f.write(struct.pack('<I', len(chunk)))
+        f.write(chunk)
+
+
+def _read_section(f, compressed):
+    decompressor = zlib.decompressobj() if compressed else None
+    parts = []
+    try:
+        while True:
+            length, = struct.unpack('<I', _read_exactly(f, 4))
+            if length == 0:
+                break
+            chunk = _read_exactly(f, length)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            parts.append(chunk)
+        if decompressor is not None:
+            parts.append(decompressor.flush())
+    except zlib.error as err:
+        raise ValueError("Session file is corrupt: %s" % err)
+    return b''.join(parts)
+
+
+def _read_exactly(f, length):
+    data = f.read(length)
+    if len(data) != length:
+        raise ValueError("Session file is truncated")
+    return data
+
+
+def _array_chunks(a):
+    """Contents of array a as CHUNK_SIZE byte memoryviews"""
+    import numpy as np
+
+    data = memoryview(np.ascontiguousarray(a)).cast('B')
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start:start+CHUNK_SIZE]
+
+
+def _json_chunks(ids):
+    """Node ids (or edge keys) as a JSON list, a few thousand per chunk"""
+    yield b'['
+    for start in range(0, len(ids), 10000):
+        chunk = json.dumps([_encode_id(u) for u in ids[start:start+10000]])
+        if start:
+            chunk = ',' + chunk[1:-1]
+        else:
+            chunk = chunk[1:-1]
+        yield chunk.encode('utf-8')
+    yield b']'
+
+
+def _encode_id(u):
+    if isinstance(u, tuple):
+        return {'tuple': [_encode_id(i) for i in u]}
+    if u is None or isinstance(u, (bool, str)):
+        return u
+    if isinstance(u, numbers.Integral):
+        return int(u)
+    if isinstance(u, numbers.Real):
+        return float(u)
+    raise ValueError("Can't save %r in a session; node ids and edge keys "
+                     "must be numbers, strings or tuples of them" % (u,))
+
+
+def _decode_ids(data):
+    return [_decode_id(u) for u in json.loads(data.decode('utf-8'))]
+
+
+def _decode_id(u):
+    if isinstance(u, dict):
+        return tuple(_decode_id(i) for i in u['tuple'])
+    return u
+
+
+def _bitset(flags):
+    import numpy as np
+
+    return np.packbits(np.asarray(flags, dtype=bool))
+
+
+def _unbitset(data, count):
+    import numpy as np
+
+    bits = np.unpackbits(np.frombuffer(data, np.uint8))[:count]
+    return bits.astype(bool)
@@ -0,0 +1,107 @@
+"""
+Run many canvas commands as a few Tcl scripts instead of one Tkinter call
+each.
+"""
+try:
+    # Python 3
+    from tkinter import _stringify, TclError
+except ImportError:
+    # Python 2
+    from Tkinter import _stringify, TclError
+
+
+class TclBatch(object):
+    """Canvas commands queued up to be run together by run.  Each Tkinter
+    call marshals its arguments and makes a round trip through the Tcl
+    interpreter; a batch sends chunk_size commands per round trip instead.
+
+    Commands can't return anything until the batch runs, so create takes a
+    callback which is passed the new item's id then.  A command which fails
+    doesn't stop the rest of the batch (or their callbacks); run raises
+    TclError for the first failure once they're all done.
+
+    Typical use:
+        >>> batch = TclBatch(canvas)
+        >>> batch.create('line', (0, 0, 10, 10), {'fill': 'red'}, callback)
+        >>> batch.coords(item, (5, 5, 20, 20))
+        >>> batch.run()
+        >>> batch.round_trips_saved
+        1
+    """
+
+    def __init__(self, canvas, chunk_size=2000):
+        self.canvas = canvas
+        self.chunk_size = chunk_size
+        self._commands = []
+        self._callbacks = []
+
+        # Totals over every run
+        self.commands_run = 0
+        self.scripts_run = 0
+
+    def create(self, kind, coords, options=None, callback=None):
+        """Queue creating an item of kind ('line', 'oval', ...).  callback
+        is called with the item's id when the batch runs."""
+        words = ['create', kind] + [float(c) for c in coords]
+        words.extend(self.canvas._options(options or {}))
+        command = ' '.join(_stringify(w) for w in words)
+        if callback is None:
+            self._queue(command)
+        else:
+            self._queue(command, lambda result: callback(int(result)))
+
+    def coords(self, item, coords):
+        """Queue setting the coordinates of item"""
+        # repr gives back exactly the same floats when Tcl parses them
+        self._queue('coords %s %s' % (item, ' '.join(repr(float(c))
+                                                     for c in coords)))
+
+    def itemconfig(self, item, options):
+        """Queue configuring item (or tag) with the dict options"""
+        words = ['itemconfigure', item]
+        words.extend(self.canvas._options(options))
+        self._queue(' '.join(_stringify(w) for w in words))
+
+    def _queue(self, command, callback=None):
+        self._commands.append(command)
+        self._callbacks.append(callback)
+
+    def run(self):
+        """Run the queued commands, then their callbacks.  Raises TclError
+        if any of the commands failed."""
+        canvas = self.canvas
+        error = None
+        while self._commands:
+            commands = self._commands[:self.chunk_size]
+            callbacks = self._callbacks[:self.chunk_size]
+            del self._commands[:self.chunk_size]
+            del self._callbacks[:self.chunk_size]
+
+            # One script which returns whether each of its commands failed
+            #  (catch's return code) and its result (or error message)
+            script = 'list ' + ' '.join(
+                '[catch {%s %s} ::_nxv_batch_result] $::_nxv_batch_result'
+                % (canvas._w, c) for c in commands)
+            results = canvas.tk.splitlist(canvas.tk.eval(script))
+            self.scripts_run += 1
+            self.commands_run += len(commands)
+
+            for i, callback in enumerate(callbacks):
+                code, result = results[2*i], results[2*i+1]
+                if int(code) != 0:
+                    if error is None:
+                        error = '%s (in "%s")' % (result, commands[i])
+                elif callback is not None:
+                    callback(result)
+
+        if error is not None:
+            raise TclError(error)
+
+    @property
+    def round_trips_saved(self):
+        """How many fewer round trips to Tcl than calling each command on
+        its own took"""
+        return self.commands_run - self.scripts_run
+
+    def __len__(self):
+        return len(self._commands)
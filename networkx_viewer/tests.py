@@ -1,5 +1,6 @@
 import unittest
-from mock import patch
+import time
+from mock import patch, Mock
 import networkx as nx
 
 try:
@@ -123,6 +124,542 @@ class TestGraphCanvas(unittest.TestCase):
 
         self.check_num_nodes_edges(5, 3)
 
+    def test_disp_node_index(self):
+        # The dataG <-> dispG index must track draws, hides and clears
+        self.display_a()
+        c = self.a._find_disp_node('c')
+        self.a.hide_node(c)
+
+        expected = {d['dataG_id']: n for n, d in self.a.dispG.nodes(data=True)}
+        self.assertEqual(self.a._data_to_disp, expected)
+        self.assertEqual(self.a._disp_to_data,
+                         {n: u for u, n in expected.items()})
+        with self.assertRaises(ValueError):
+            self.a._find_disp_node('c')
+
+        self.a.clear()
+        self.assertEqual(self.a._data_to_disp, {})
+        self.assertEqual(self.a._disp_to_data, {})
+
+    def test_edge_token_index(self):
+        # Every displayed edge's canvas item maps back to its dispG edge
+        self.display_a()
+        self.a.hide_node(self.a._find_disp_node('c'))
+
+        expected = {d['token'].id: (frozenset((u, v)), k)
+                    for u, v, k, d in self.a.dispG.edges(keys=True, data=True)}
+        actual = {i: (frozenset((u, v)), k)
+                  for i, (u, v, k) in self.a._edge_tokens.items()}
+        self.assertEqual(actual, expected)
+
+        self.a.clear()
+        self.assertEqual(self.a._edge_tokens, {})
+
+    def test_barnes_hut_layout(self):
+        self.a.layout_engine = 'barnes_hut'
+        self.display_a()
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+
+        # Fixed nodes must stay where they are
+        fixed = {n: (10.0*i, 20.0*i) for i, n in enumerate(['a', 2, 'c'])}
+        layout = self.a.create_layout(self.input_G, pos=fixed,
+                                      fixed=list(fixed.keys()))
+        for n, xy in fixed.items():
+            self.assertEqual(tuple(layout[n]), xy)
+
+    def test_multilevel_layout(self):
+        # Force every layout through the multilevel engine
+        self.a.multilevel_threshold = 0
+        self.display_a()
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+
+        out = self.a._find_disp_node('out')
+        self.a.grow_node(out)
+        self.check_subgraph()
+        self.check_num_nodes_edges(8, 11)
+
+    def wait_for_layout(self, timeout=30):
+        """Pump the Tk event loop until the background layout finishes"""
+        end = time.time() + timeout
+        while self.a._layout_job is not None:
+            if time.time() > end:
+                self.fail("Background layout did not finish")
+            self.a.update()
+            time.sleep(0.01)
+
+    def test_background_layout(self):
+        self.a.background_layout = True
+        self.display_a()
+        # Nodes and edges are drawn right away, before the layout finishes
+        self.assertIsNot(self.a._layout_job, None)
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+
+        self.wait_for_layout()
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+
+        # Growing animates only the new nodes; existing nodes stay put
+        a = self.a._find_disp_node('a')
+        a_xy = self.a._node_xy(a)
+        self.a.grow_node(self.a._find_disp_node('out'))
+        self.wait_for_layout()
+        self.check_subgraph()
+        self.check_num_nodes_edges(8, 11)
+        self.assertEqual(self.a._node_xy(a), a_xy)
+
+    def test_background_layout_zoom(self):
+        import threading
+        import numpy as np
+
+        def frame(G, k):
+            return dict((n, np.array([k*30.*i, k*50.*(i % 3)]))
+                        for i, n in enumerate(sorted(G, key=str)))
+        sent = threading.Event()
+        zoomed = threading.Event()
+        def create_layout(G, callback=None, **kwargs):
+            if callback is None:
+                return frame(G, 1)
+            callback(frame(G, 1))
+            sent.set()
+            zoomed.wait(10)
+            return frame(G, 2)
+
+        self.a.background_layout = True
+        with patch.object(self.a, 'create_layout', side_effect=create_layout):
+            self.display_a()
+            sent.wait(10)
+            end = time.time() + 10
+            while not self.a._layout_job['frames'].empty():
+                if time.time() > end:
+                    self.fail("Background layout frame not shown")
+                self.a.update()
+                time.sleep(0.01)
+
+            # Zooming partway through scales the rest of the layout too
+            self.a._zoom(0, 0, 0.5)
+            zoomed.set()
+            self.wait_for_layout()
+
+        final = frame(self.a._neighbors('a', levels=2), 2)
+        ax, ay = self.a._node_xy(self.a._find_disp_node('a'))
+        for n, d in self.a.dispG.nodes(data=True):
+            x, y = self.a._node_xy(n)
+            expected = (final[d['dataG_id']] - final['a'])*0.5
+            self.assertAlmostEqual(x - ax, expected[0])
+            self.assertAlmostEqual(y - ay, expected[1])
+
+    def test_cancel_layout(self):
+        self.a.background_layout = True
+        self.display_a()
+        disp_node = self.a._find_disp_node('a')
+        self.a.cancel_layout()
+        self.assertIs(self.a._layout_job, None)
+
+        # Nodes stay where they were when the layout was cancelled
+        xy = self.a._node_xy(disp_node)
+        self.a.update()
+        time.sleep(0.1)
+        self.a.update()
+        self.assertEqual(self.a._node_xy(disp_node), xy)
+        self.check_subgraph()
+
+    def test_progressive(self):
+        self.a.progressive = True
+        # Draw one node or edge per chunk
+        self.a.render_budget = 0
+        self.display_a()
+        # Only the home node is drawn right away
+        self.assertIsNot(self.a._render_job, None)
+        self.check_num_nodes_edges(1, 0)
+        self.a._find_disp_node('a')
+        self.assertEqual(len(self.a.find_withtag('progress')), 1)
+
+        end = time.time() + 30
+        while self.a._render_job is not None:
+            if time.time() > end:
+                self.fail("Progressive plot did not finish")
+            self.a.update()
+            time.sleep(0.01)
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+        self.assertEqual(self.a.find_withtag('progress'), ())
+
+        # Interrupting keeps what's been drawn
+        self.display_a()
+        self.a.cancel_render()
+        self.assertIs(self.a._render_job, None)
+        self.check_num_nodes_edges(1, 0)
+        self.assertEqual(self.a.find_withtag('progress'), ())
+
+        # Home nodes are drawn first, in the order given
+        self.a.plot(['d', 'a'], levels=1)
+        self.check_num_nodes_edges(1, 0)
+        self.a._find_disp_node('d')
+        self.a.cancel_render()
+
+    def test_progressive_positions(self):
+        import numpy as np
+
+        def create_layout(G, **kwargs):
+            return dict((n, np.array([30.*i, 50.*(i % 3)]))
+                        for i, n in enumerate(sorted(G, key=str)))
+        self.a.progressive = True
+        self.a.render_budget = 0
+        with patch.object(self.a, 'create_layout',
+                          side_effect=create_layout):
+            # plot centers on 'a' before the rest are drawn
+            self.display_a()
+        layout = create_layout(self.input_G.subgraph(
+            self.a._neighbors('a', levels=2)))
+        self.check_num_nodes_edges(1, 0)
+
+        # Zooming partway through moves the rest along with it
+        self.a._zoom(0, 0, 0.5)
+        self.a._finish_render()
+        self.check_num_nodes_edges(6, 8)
+        ax, ay = self.a._node_xy(self.a._find_disp_node('a'))
+        for n, d in self.a.dispG.nodes(data=True):
+            x, y = self.a._node_xy(n)
+            expected = (layout[d['dataG_id']] - layout['a'])*0.5
+            self.assertAlmostEqual(x - ax, expected[0])
+            self.assertAlmostEqual(y - ay, expected[1])
+
+    def test_complete_notified(self):
+        # New tokens are told they're complete, even though that's what
+        #  they start as; others only when it changes
+        with patch.object(self.a._NodeTokenClass, 'mark_complete',
+                          autospec=True) as mark_complete:
+            self.display_a()
+            told = set(c[0][0] for c in mark_complete.call_args_list)
+            for n, d in self.a.dispG.nodes(data=True):
+                complete = (self.a.dispG.degree(n) ==
+                            self.input_G.degree(d['dataG_id']))
+                self.assertEqual(d['token'] in told, complete)
+
+            mark_complete.reset_mock()
+            self.a._graph_changed()
+            self.assertFalse(mark_complete.called)
+
+    def test_undo_budget(self):
+        self.a._undo_states.max_entries = 1
+        self.display_a()
+        self.a.hide_node(self.a._find_disp_node('c'))
+        usage = self.a.undo_usage()
+        self.assertEqual(usage['entries'], 2)
+        self.assertEqual(usage['spilled_entries'], 1)
+        self.assertGreater(usage['disk_bytes'], 0)
+
+        # Undoing past what's in memory reads the spilled state back
+        self.a.undo()
+        self.check_num_nodes_edges(6, 8)
+        self.a.undo()
+        self.check_subgraph()
+        self.assertEqual(self.a.undo_usage()['spilled_entries'], 0)
+
+    def test_undo_incremental(self):
+        self.display_a()
+        tokens = dict((n, d['token']) for n, d in self.a.dispG.nodes(data=True))
+        a = self.a._find_disp_node('a')
+        a_xy = self.a._node_xy(a)
+        self.a.mark_node(a)
+        self.a.hide_node(self.a._find_disp_node('out'))
+        self.a._move_node(a, 10, 10)
+
+        self.a.undo()
+        self.a.undo()
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+        self.assertFalse(self.a.dispG.nodes[a]['token'].is_marked)
+        self.assertEqual(self.a._node_xy(a), a_xy)
+
+        # Only the hidden node was drawn again
+        for n, d in self.a.dispG.nodes(data=True):
+            if d['dataG_id'] != 'out':
+                self.assertIs(d['token'], tokens[n])
+
+    def test_session(self):
+        import os
+        import tempfile
+
+        self.display_a()
+        a = self.a._find_disp_node('a')
+        c = self.a._find_disp_node('c')
+        self.a.mark_node(a)
+        self.a.mark_edge(a, c, 0)
+        xy = self.a._node_xy(a)
+
+        fd, path = tempfile.mkstemp(suffix='.nxs')
+        os.close(fd)
+        try:
+            self.a.save_session(path)
+            self.a.clear()
+            self.a.plot('out', levels=1)
+            self.a.open_session(path)
+        finally:
+            os.remove(path)
+
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+        a = self.a._find_disp_node('a')
+        c = self.a._find_disp_node('c')
+        self.assertEqual(self.a._node_xy(a), xy)
+        self.assertTrue(self.a.dispG.nodes[a]['token'].is_marked)
+        self.assertTrue(self.a.dispG[a][c][0]['token'].is_marked)
+
+    def test_session_bad_file(self):
+        import os
+        import tempfile
+
+        self.display_a()
+        self.a.hide_node(self.a._find_disp_node('c'))
+
+        fd, path = tempfile.mkstemp(suffix='.nxs')
+        os.close(fd)
+        try:
+            self.a.save_session(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path, 'wb') as f:
+                f.write(data[:-10])
+            self.assertRaises(ValueError, self.a.open_session, path)
+        finally:
+            os.remove(path)
+
+        # Display untouched, and undo still works
+        self.check_num_nodes_edges(5, 3)
+        self.assertFalse(self.a._undo_suspend)
+        self.a.undo()
+        self.check_num_nodes_edges(6, 8)
+
+    def test_session_save_fails(self):
+        import os
+        import tempfile
+
+        self.display_a()
+        fd, path = tempfile.mkstemp(suffix='.nxs')
+        os.write(fd, b'keep me')
+        os.close(fd)
+        files = set(os.listdir(os.path.dirname(path)))
+        try:
+            with patch('networkx_viewer.session.write_session',
+                       side_effect=ValueError):
+                self.assertRaises(ValueError, self.a.save_session, path)
+            # path untouched and the temporary file cleaned up
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'keep me')
+            self.assertEqual(set(os.listdir(os.path.dirname(path))), files)
+        finally:
+            os.remove(path)
+
+    def test_layout_cache(self):
+        def positions():
+            return dict((d['dataG_id'], self.a._node_xy(n))
+                        for n, d in self.a.dispG.nodes(data=True))
+
+        self.display_a()
+        first = positions()
+
+        # Plotting the same neighborhood again gives the same picture
+        self.display_a()
+        self.assertEqual(positions(), first)
+
+        # ...even without the cache, since the seed comes from the graph
+        self.a.layout_cache.clear()
+        self.display_a()
+        self.assertEqual(positions(), first)
+
+        # Replot asks for a new layout and caches it instead
+        self.a.replot()
+        second = positions()
+        self.assertNotEqual(second, first)
+        self.display_a()
+        self.assertEqual(positions(), second)
+
+    def test_coordinate_map(self):
+        self.a.coordinate_map = nxv.CoordinateMap.compute(self.input_G, seed=0)
+        with patch.object(self.a, 'create_layout') as create_layout:
+            self.display_a()
+            self.check_subgraph()
+            self.check_num_nodes_edges(6, 8)
+
+            # Nodes are placed where the map says, up to scale and offset
+            def vector(u, v):
+                u_xy = self.a._node_xy(self.a._find_disp_node(u))
+                v_xy = self.a._node_xy(self.a._find_disp_node(v))
+                return (v_xy[0] - u_xy[0], v_xy[1] - u_xy[1])
+            cmap = self.a.coordinate_map
+            for u, v in [('a', 'c'), ('a', 'd'), (2, 4)]:
+                expected = (cmap[v] - cmap[u])*self.a._map_scale
+                for actual, exp in zip(vector(u, v), expected):
+                    self.assertAlmostEqual(actual, exp, delta=1)
+
+            self.a.grow_node(self.a._find_disp_node('out'))
+            self.check_subgraph()
+            self.check_num_nodes_edges(8, 11)
+            self.assertFalse(create_layout.called)
+
+    def test_coordinate_map_empty(self):
+        # Growing from an empty display has nothing to align the map to
+        self.a.coordinate_map = nxv.CoordinateMap.compute(self.input_G, seed=0)
+        self.a.clear()
+        with patch.object(self.a, 'create_layout') as create_layout:
+            self.a._plot_additional(['a', 2, 'c'])
+            self.check_subgraph()
+            self.check_num_nodes_edges(3, 3)
+            self.assertFalse(create_layout.called)
+
+    def test_zoom(self):
+        event = Mock(widget=self.a, x=100, y=50, delta=-120)  # Zoom out
+
+        before = dict((n, self.a._node_xy(n)) for n in self.a.dispG)
+        self.a.onZoon(event)
+
+        # Nodes moved toward the cursor
+        for n, (x, y) in before.items():
+            x2, y2 = self.a._node_xy(n)
+            self.assertAlmostEqual(x2, 100 + (x-100)*0.9, delta=1)
+            self.assertAlmostEqual(y2, 50 + (y-50)*0.9, delta=1)
+
+        # Edges still run between their nodes
+        for u, v, d in self.a.dispG.edges(data=True):
+            if d['token'].id is None:
+                # Out of view of a virtual canvas
+                continue
+            if d['dispG_frm'] != u:
+                u, v = v, u
+            coords = self.a.coords(d['token'].id)
+            for actual, expected in zip(coords[:2] + coords[-2:],
+                                        self.a._node_center(u) +
+                                        self.a._node_center(v)):
+                self.assertAlmostEqual(actual, expected, delta=1)
+
+    def test_redraw_coalesced(self):
+        event = Mock(x=0, y=0)
+
+        a = self.a._find_disp_node('a')
+        x, y = self.a._node_xy(a)
+        self.a._drag_data.update(item=a, x=0, y=0)
+        with patch.object(self.a, '_move_node',
+                          wraps=self.a._move_node) as move_node:
+            for i in range(1, 11):
+                event.x, event.y = i, 2*i
+                self.a.onNodeMotion(event)
+            self.assertFalse(move_node.called)
+
+            # All the motion is drawn at once
+            self.a.update()
+            self.assertEqual(move_node.call_count, 1)
+        x2, y2 = self.a._node_xy(a)
+        self.assertAlmostEqual(x2, x+10)
+        self.assertAlmostEqual(y2, y+20)
+
+        # Edges followed
+        for u, v, d in self.a.dispG.edges(a, data=True):
+            if d['token'].id is None:
+                # Out of view of a virtual canvas
+                continue
+            coords = self.a.coords(d['token'].id)
+            self.assertIn(self.a._node_center(a),
+                          [tuple(coords[:2]), tuple(coords[-2:])])
+
+    def test_batch(self):
+        self.display_a()
+        undo = len(self.a._undo_states)
+        token = self.a.dispG.nodes[self.a._find_disp_node(2)]['token']
+
+        with self.a.batch():
+            self.a.hide_node(self.a._find_disp_node('c'))
+            with self.a.batch():
+                self.a.hide_node(self.a._find_disp_node('d'))
+            # Completeness isn't updated until the end of the batch
+            self.assertTrue(token.is_complete)
+        self.assertFalse(token.is_complete)
+        self.check_subgraph()
+        self.check_num_nodes_edges(4, 2)
+
+        # ...which is undone as one
+        self.assertEqual(len(self.a._undo_states), undo + 1)
+        self.a.undo()
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+
+        # A batch which changes nothing saves nothing and keeps the redo
+        #  history
+        with self.a.batch():
+            pass
+        self.assertEqual(len(self.a._undo_states), undo)
+        self.assertEqual(len(self.a._redo_states), 1)
+
+    def test_click_not_undoable(self):
+        event = Mock(x=0, y=0)
+
+        a = self.a._find_disp_node('a')
+        xy = self.a._node_xy(a)
+        self.a.mark_node(a)
+        self.a.undo()
+        undo, redo = len(self.a._undo_states), len(self.a._redo_states)
+
+        # Clicking a node saves nothing and keeps the redo history
+        with patch.object(self.a, '_get_id', return_value=a):
+            self.a.onNodeButtonPress(event)
+            self.a.onNodeButtonRelease(event)
+            self.assertEqual(len(self.a._undo_states), undo)
+            self.assertEqual(len(self.a._redo_states), redo)
+
+            # Dragging it can be undone
+            self.a.onNodeButtonPress(event)
+            for i in range(1, 4):
+                event.x = i
+                self.a.onNodeMotion(event)
+            self.a.onNodeButtonRelease(event)
+        self.assertEqual(len(self.a._undo_states), undo + 1)
+        self.assertEqual(len(self.a._redo_states), 0)
+        self.assertEqual(self.a._node_xy(a), (xy[0]+3, xy[1]))
+        self.a.undo()
+        self.assertEqual(self.a._node_xy(a), xy)
+
+    def test_tcl_batch(self):
+        from networkx_viewer.tcl_batch import TclBatch
+
+        # The 8 edges are drawn by a single script
+        saved = self.a.tcl_round_trips_saved
+        self.display_a()
+        if not self.a.virtual:
+            self.assertEqual(self.a.tcl_round_trips_saved - saved, 7)
+        for u, v, d in self.a.dispG.edges(data=True):
+            if d['token'].id is None:
+                # Out of view of a virtual canvas
+                continue
+            self.assertIn(d['token'].id, self.a._edge_tokens)
+            self.assertEqual(self.a.type(d['token'].id), 'line')
+
+        ids = []
+        batch = TclBatch(self.a, chunk_size=2)
+        batch.create('line', (0, 0, 10, 10), {'dash': (2, 2)}, ids.append)
+        batch.create('text', (5, 5), {'text': 'a {tricky} label'},
+                     ids.append)
+        batch.run()
+        batch.coords(ids[0], (1.5, 2.5, 3.5, 4.5))
+        batch.itemconfig(ids[1], {'fill': 'red'})
+        batch.run()
+        self.assertEqual(batch.round_trips_saved, 2)
+        self.assertEqual(self.a.coords(ids[0]), [1.5, 2.5, 3.5, 4.5])
+        self.assertEqual(self.a.itemcget(ids[1], 'text'), 'a {tricky} label')
+        self.assertEqual(self.a.itemcget(ids[1], 'fill'), 'red')
+
+        # A failing command doesn't stop the rest of its chunk
+        from networkx_viewer.tcl_batch import TclError
+        ids = []
+        batch = TclBatch(self.a)
+        batch.create('line', (0, 0, 10, 10), None, ids.append)
+        batch.create('no_such_kind', (0, 0), None, ids.append)
+        batch.create('oval', (0, 0, 10, 10), None, ids.append)
+        self.assertRaises(TclError, batch.run)
+        self.assertEqual([self.a.type(i) for i in ids], ['line', 'oval'])
+
     def test_hide_behind(self):
         # Center the graph around node "out"
         self.a.clear()
@@ -193,6 +730,34 @@ class TestGraphCanvas(unittest.TestCase):
         self.assertIsNot(node_11, None)
         self.assertIsNot(TTTTT, None)
 
+    def test_component_layout(self):
+        self.a.component_layout = True
+        self.a.layout_processes = 1
+        self.a.plot(['a','qqqq','alone'])
+        self.assertEqual(nx.number_connected_components(self.a.dispG), 2)
+        self.check_num_nodes_edges(9, 9)
+        self.check_subgraph()
+
+        # Every node got its own spot
+        xy = set(self.a._node_xy(n) for n in self.a.dispG)
+        self.assertEqual(len(xy), 9)
+
+    def test_component_layout_pool(self):
+        self.a.component_layout = True
+        self.a.layout_processes = 2
+        # Small enough that both components go to the pool
+        self.a.component_pool_min_size = 2
+        self.a.plot(['a','qqqq','alone'])
+        self.check_num_nodes_edges(9, 9)
+        self.check_subgraph()
+        xy = set(self.a._node_xy(n) for n in self.a.dispG)
+        self.assertEqual(len(xy), 9)
+
+        # Workers are started fresh, not forked from the Tk process
+        pool = self.a._layout_pool
+        self.assertIsNot(pool, None)
+        self.assertEqual(pool._mp_context.get_start_method(), 'spawn')
+
     def test_plot_path_error_no_node(self):
         self.a.clear()
         with patch(SHOWERROR_FUNC) as errorMsgBox:
@@ -321,6 +886,313 @@ class TestGraphCanvas(unittest.TestCase):
         self.assertEqual(out_token.is_marked, True)
 
 
+class TestLayoutForces(unittest.TestCase):
+    def test_matches_exact(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import _quadtree_repulsion
+
+        np.random.seed(0)
+        pos = np.random.random((400, 2))
+        k2 = 1.0/len(pos)
+
+        delta = pos[:,None,:] - pos[None,:,:]
+        distance2 = (delta**2).sum(axis=-1)
+        distance2 = np.where(distance2<1e-4, 1e-4, distance2)
+        exact = (delta * (k2/distance2)[:,:,None]).sum(axis=1)
+
+        approx = _quadtree_repulsion(pos, k2)
+        err = np.linalg.norm(approx - exact) / np.linalg.norm(exact)
+        self.assertLess(err, 0.05)
+
+    def test_match_nodes(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import _match_nodes
+
+        G = nx.path_graph(10)
+        A = nx.adjacency_matrix(G)
+        fixed = np.zeros(10, dtype=bool)
+        fixed[[0, 5]] = True
+        group, ngroups = _match_nodes(A, fixed)
+
+        self.assertEqual(group.max() + 1, ngroups)
+        sizes = np.bincount(group)
+        self.assertTrue((sizes <= 2).all())
+        # Fixed nodes are never collapsed with anything else
+        self.assertEqual(sizes[group[0]], 1)
+        self.assertEqual(sizes[group[5]], 1)
+        # Only adjacent nodes are collapsed together
+        for g in range(ngroups):
+            members = np.flatnonzero(group == g)
+            if len(members) == 2:
+                self.assertTrue(G.has_edge(*members))
+
+    def test_sparse_attraction_matches_dense(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import _edge_arrays, _edge_attraction
+
+        G = nx.gnm_random_graph(50, 120, seed=1)
+        A = nx.adjacency_matrix(G)
+        np.random.seed(0)
+        pos = np.random.random((len(G), 2))
+        k = 0.1
+
+        dense = np.asarray(A.todense(), dtype='float64')
+        delta = pos[:,None,:] - pos[None,:,:]
+        distance = np.sqrt((delta**2).sum(axis=-1))
+        distance = np.where(distance<0.01, 0.01, distance)
+        expected = (delta * (dense*distance/k)[:,:,None]).sum(axis=1)
+
+        for adj in (A, dense):
+            rows, cols, weights = _edge_arrays(adj)
+            actual = _edge_attraction(pos, rows, cols, weights, k)
+            self.assertTrue(np.allclose(actual, expected))
+
+
+    def test_pack_rectangles(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import _pack_rectangles
+
+        np.random.seed(0)
+        sizes = np.random.random((30, 2))*5
+        corners = _pack_rectangles(sizes, padding=1.0)
+        hi = corners + sizes + 1.0
+        for i in range(len(sizes)):
+            for j in range(i+1, len(sizes)):
+                apart = ((hi[i] <= corners[j] + 1e-9) |
+                         (hi[j] <= corners[i] + 1e-9))
+                self.assertTrue(apart.any(), "%d and %d overlap" % (i, j))
+        # Packed into a roughly square area
+        width, height = hi.max(axis=0)
+        self.assertLess(max(width, height) / min(width, height), 3)
+
+    def test_closest_distance(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import _closest_distance
+
+        np.random.seed(0)
+        on_a_line = np.column_stack((np.random.random(100), np.zeros(100)))
+        clustered = np.concatenate((np.random.random((100, 2))*1e-3,
+                                    [[1000., 1000.]]))
+        duplicates = np.round(np.random.random((100, 2))*3)
+        for pos in (np.random.random((300, 2)), on_a_line, clustered,
+                    duplicates):
+            distance = np.sqrt(((pos[:,None,:] - pos[None,:,:])**2).sum(-1))
+            expected = np.where(distance==0, np.inf, distance).min()
+            self.assertAlmostEqual(_closest_distance(pos), expected)
+
+        self.assertEqual(_closest_distance(np.ones((5, 2))), np.inf)
+
+
+class TestLayoutCache(unittest.TestCase):
+    def test_make_key(self):
+        from networkx_viewer.layout_cache import LayoutCache
+
+        G = nx.Graph([('a', 'b'), ('b', 'c')])
+        H = nx.Graph([('c', 'b'), ('b', 'a')])
+        key = LayoutCache.make_key(G, scale=1.0)
+        # Independent of insertion order and edge orientation
+        self.assertEqual(LayoutCache.make_key(H, scale=1.0), key)
+        # ...but not of the graph or the parameters
+        H.add_edge('a', 'c')
+        self.assertNotEqual(LayoutCache.make_key(H, scale=1.0), key)
+        self.assertNotEqual(LayoutCache.make_key(G, scale=2.0), key)
+
+    def test_lru(self):
+        from networkx_viewer.layout_cache import LayoutCache
+
+        cache = LayoutCache(max_entries=2)
+        cache.put('a', {1: (0, 0)})
+        cache.put('b', {1: (1, 1)})
+        cache.get('a')
+        cache.put('c', {1: (2, 2)})
+        # 'b' was the least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('b', cache)
+        self.assertIs(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), {1: (0, 0)})
+
+    def test_disk(self):
+        import shutil
+        import tempfile
+        from networkx_viewer.layout_cache import LayoutCache
+
+        directory = tempfile.mkdtemp()
+        try:
+            LayoutCache(directory=directory).put('a', {1: (0, 0)})
+            cache = LayoutCache(directory=directory)
+            self.assertIn('a', cache)
+            self.assertEqual(cache.get('a'), {1: (0, 0)})
+            self.assertIs(cache.get('b'), None)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestUndoHistory(unittest.TestCase):
+    def test_spill(self):
+        from networkx_viewer.undo_history import UndoHistory
+
+        history = UndoHistory(max_entries=2, max_bytes=250)
+        states = [str(i).encode('ascii')*100 for i in range(5)]
+        for state in states:
+            history.push(state)
+        # Only the newest two fit in memory
+        self.assertEqual(len(history), 5)
+        self.assertEqual(history.spilled, 3)
+        self.assertEqual(history.memory_usage, 200)
+        self.assertLess(history.disk_usage, 300)
+
+        # ...but they all come back, newest first
+        self.assertEqual([history.pop() for i in range(5)], states[::-1])
+        self.assertEqual(history.disk_usage, 0)
+        self.assertRaises(IndexError, history.pop)
+
+        # A state too big for the budget still stays in memory
+        history.max_bytes = 50
+        history.push(states[0])
+        history.push(states[1])
+        self.assertEqual(history.memory_usage, 100)
+        history.clear()
+        self.assertFalse(history)
+
+
+class TestSession(unittest.TestCase):
+    def test_round_trip(self):
+        import io
+        import numpy as np
+        from networkx_viewer import session
+
+        ids = ['a', 2, (3, 'b'), 4.5]
+        xy = np.arange(8, dtype=float).reshape(4, 2)
+        for compress in (True, False):
+            f = io.BytesIO()
+            session.write_session(f, ids, xy, [True, False, False, True],
+                                  [(0, 1), (2, 3), (0, 1)], [0, 'road', 1],
+                                  [False, True, False], view_scale=0.5,
+                                  compress=compress)
+            f.seek(0)
+            saved = session.read_session(f)
+            self.assertEqual(saved['node_ids'], ids)
+            self.assertEqual(saved['node_xy'].tolist(), xy.tolist())
+            self.assertEqual(saved['node_marked'].tolist(),
+                             [True, False, False, True])
+            self.assertEqual(saved['edge_ends'].tolist(),
+                             [[0, 1], [2, 3], [0, 1]])
+            self.assertEqual(saved['edge_keys'], [0, 'road', 1])
+            self.assertEqual(saved['edge_marked'].tolist(),
+                             [False, True, False])
+            self.assertEqual(saved['view_scale'], 0.5)
+
+        self.assertRaises(ValueError, session.read_session,
+                          io.BytesIO(b'not a session'))
+        data = f.getvalue()
+        for end in (len(session.MAGIC) + 5, len(data) // 2, len(data) - 1):
+            self.assertRaises(ValueError, session.read_session,
+                              io.BytesIO(data[:end]))
+        self.assertRaises(ValueError, session.write_session, io.BytesIO(),
+                          [object()], [(0, 0)], [False], [], [], [])
+        self.assertRaises(ValueError, session.write_session, io.BytesIO(),
+                          [0], [(0, 0)], [False], [(0, 0)], [object()],
+                          [False])
+
+
+class TestCoordinateMap(unittest.TestCase):
+    def test_save_load(self):
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+
+        G = nx.path_graph(['a', 'b', 'c', 'd'])
+        cmap = nxv.CoordinateMap.compute(G, seed=0)
+        self.assertEqual(len(cmap), 4)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'coords.npy')
+            cmap.save(path)
+            loaded = nxv.CoordinateMap.load(path)
+            self.assertIsInstance(loaded.positions, np.memmap)
+            self.assertEqual(loaded.nodes, cmap.nodes)
+            self.assertTrue(np.allclose(loaded['c'], cmap['c']))
+
+            # Without the node list, rows follow the graph's node order
+            os.remove(path + '.nodes')
+            self.assertRaises(ValueError, nxv.CoordinateMap.load, path)
+            loaded = nxv.CoordinateMap.load(path, G)
+            self.assertTrue(np.allclose(loaded['c'], cmap['c']))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lookup(self):
+        import numpy as np
+
+        cmap = nxv.CoordinateMap(['a', 'b'], np.array([[0., 1.], [2., 3.]]))
+        pos, found = cmap.lookup(['b', 'x', 'a'])
+        self.assertEqual(found.tolist(), [True, False, True])
+        self.assertEqual(pos[0].tolist(), [2., 3.])
+        self.assertEqual(pos[2].tolist(), [0., 1.])
+        self.assertTrue(np.isnan(pos[1]).all())
+        self.assertNotIn('x', cmap)
+
+class TestEdgeGeometry(unittest.TestCase):
+    def test_spline_coords(self):
+        import numpy as np
+        from networkx_viewer.graph_canvas import GraphCanvas, _spline_coords
+
+        class Canvas(object):
+            _view_scale = 1.0
+
+        rng = np.random.RandomState(0)
+        p1 = rng.uniform(-500, 500, (50, 2))
+        p2 = rng.uniform(-500, 500, (50, 2))
+        m = rng.choice([0., 15., -15., 30.], 50)
+        coords = _spline_coords(p1, p2, m)
+        self.assertEqual(coords.shape, (50, 6))
+        for i in range(50):
+            x1, y1 = p1[i]
+            x2, y2 = p2[i]
+            xa, ya = GraphCanvas._spline_center(Canvas(), x1, y1, x2, y2,
+                                                m[i])
+            self.assertTrue(np.allclose(coords[i], [x1, y1, xa, ya, x2, y2]))
+
+class TestNodePositions(unittest.TestCase):
+    def test_add_remove(self):
+        from networkx_viewer.positions import NodePositions
+
+        pos = NodePositions(capacity=2)
+        for i in range(5):
+            pos.add(i, i, 10*i)
+        self.assertEqual(len(pos), 5)
+        self.assertEqual(pos[3], (3., 30.))
+
+        # Removing packs the last node into the hole
+        pos.remove(1)
+        self.assertEqual(pos.nodes, [0, 4, 2, 3])
+        self.assertEqual(pos.xy.tolist(),
+                         [[0., 0.], [4., 40.], [2., 20.], [3., 30.]])
+        self.assertEqual(pos[4], (4., 40.))
+        self.assertNotIn(1, pos)
+
+        pos.move(4, 1, 2)
+        self.assertEqual(pos[4], (5., 42.))
+        pos[0] = (7, 8)
+        self.assertEqual(pos[0], (7., 8.))
+
+    def test_view_transforms(self):
+        from networkx_viewer.positions import NodePositions
+
+        pos = NodePositions()
+        pos.add('a', 0, 0)
+        pos.add('b', 10, 20)
+        pos.translate(5, -5)
+        self.assertEqual(pos['b'], (15., 15.))
+        pos.scale(5, -5, 0.5)
+        self.assertEqual(pos['a'], (5., -5.))
+        self.assertEqual(pos['b'], (10., 5.))
+        self.assertEqual(pos.within(0, 0, 20, 20), ['b'])
+        self.assertEqual(pos.rows(['b', 'a']).tolist(), [1, 0])
+
+
 class TestGraphCanvasFiltered(TestGraphCanvas):
     def setUp(self):
         super(TestGraphCanvasFiltered, self).setUp()
@@ -432,6 +1304,37 @@ class TestGraphCanvasTkPassthrough(TestGraphCanvas):
         #  developed to test correct functionality
         cls.test_mark_edge = unittest.expectedFailure(cls.test_mark_edge)
 
+    def test_level_of_detail(self):
+        self.a.lod_scales = (0.5, 0.25)
+        self.a.edge_importance = lambda d: 0 if 'dash' in d else 1
+        self.display_a()
+        a = self.a._find_disp_node('a')
+        c = self.a._find_disp_node('c')
+        token = self.a.dispG.nodes[a]['token']
+        minor = self.a.dispG.get_edge_data(a, c, 0)['token']
+
+        event = Mock(widget=self.a, x=100, y=50)
+
+        def zoom(delta, times):
+            event.delta = delta
+            for i in range(times):
+                self.a.onZoon(event)
+            self.a.update()
+
+        # Zoomed out past 0.5, labels are hidden
+        zoom(-120, 7)
+        self.assertEqual(token.itemcget(token.label, 'state'), 'hidden')
+        self.assertEqual(self.a.itemcget(minor.id, 'state'), '')
+
+        # ...and past 0.25, so are minor edges
+        zoom(-120, 7)
+        self.assertEqual(self.a.itemcget(minor.id, 'state'), 'hidden')
+
+        # Zooming back in brings back full detail
+        zoom(120, 14)
+        self.assertEqual(token.itemcget(token.label, 'state'), 'normal')
+        self.assertEqual(self.a.itemcget(minor.id, 'state'), 'normal')
+
     def test_mark_edge_pass(self):
         c = self.a._find_disp_node('c')
         out = self.a._find_disp_node('out')
@@ -497,20 +1400,139 @@ class TestGraphCanvasTkPassthrough(TestGraphCanvas):
         # Make node a magenta
         self.a.dataG.nodes['a']['fill'] = 'magenta'
 
-        self.a.refresh()
-
-        # See that the changes propagated through
         a = self.a._find_disp_node('a')
         c = self.a._find_disp_node('c')
+        token = self.a.dispG.nodes[a]['token']
+        marker = token.marker
+
+        # Only the changed node and edge are updated
+        self.assertEqual(self.a.refresh(), 2)
 
+        # See that the changes propagated through
         token_id = self.a.dispG.get_edge_data(a, c, 0)['token'].id
         cfg = self.a.itemconfig(token_id)
         self.assertEqual(cfg['fill'][-1], 'magenta')
 
-        token = self.a.dispG.nodes[a]['token']
         cfg = token.itemconfig(token.marker)
         self.assertEqual(cfg['fill'][-1], 'magenta')
 
+        # The token's items were updated rather than drawn again
+        self.assertEqual(token.marker, marker)
+        self.assertEqual(self.a.refresh(), 0)
+
+        # Removing the attribute puts the default back
+        del self.a.dataG.nodes['a']['fill']
+        self.assertEqual(self.a.refresh(), 1)
+        cfg = token.itemconfig(token.marker)
+        self.assertEqual(cfg['fill'][-1], 'red')
+
+class TestGraphCanvasNodeItems(TestGraphCanvasTkPassthrough):
+    def setUp(self):
+        super(TestGraphCanvasNodeItems, self).setUp()
+        G = self.input_G.copy()
+
+        # Viewer under test
+        self.a = nxv.GraphCanvas(G,
+                    EdgeTokenClass=nxv.TkPassthroughEdgeToken,
+                    NodeTokenClass=nxv.TkPassthroughNodeToken,
+                    node_items=True)
+
+    def test_node_items(self):
+        node = self.a._find_disp_node('a')
+        token = self.a.dispG.nodes[node]['token']
+        self.assertIsInstance(token, nxv.TkPassthroughNodeToken)
+
+        # Background, marker and label are items on the host canvas
+        items = self.a.find_withtag(token.tag)
+        self.assertEqual(len(items), 3)
+        self.assertIn(token.marker, items)
+        self.assertIn(token.label, items)
+        self.assertEqual(self.a.type(node), 'rectangle')
+
+        # Dragging moves them all
+        before = [self.a.coords(i) for i in items]
+        self.a._move_node(node, 10, 5)
+        for i, xy in zip(items, before):
+            self.assertEqual(self.a.coords(i)[:2], [xy[0]+10, xy[1]+5])
+
+        # Hiding and undoing removes and redraws them
+        self.a.hide_node(node)
+        self.assertEqual(self.a.find_withtag(token.tag), ())
+        self.a.undo()
+        self.check_subgraph()
+        node = self.a._find_disp_node('a')
+        self.assertEqual(len(self.a.find_withtag(self.a._node_tag(node))), 3)
+
+    def test_mark_node_background(self):
+        node = self.a._find_disp_node('a')
+        self.a.mark_node(node)
+        self.assertEqual(self.a.itemcget(node, 'fill'), 'yellow')
+        self.a.mark_node(node)
+        self.assertEqual(self.a.itemcget(node, 'fill'), '')
+
+class TestGraphCanvasVirtual(TestGraphCanvas):
+    def setUp(self):
+        super(TestGraphCanvasVirtual, self).setUp()
+        G = self.input_G.copy()
+
+        # Viewer under test
+        self.a = nxv.GraphCanvas(G, virtual=True)
+
+    def test_culling(self):
+        self.display_a()
+        self.assertTrue(self.a.find_withtag('node'))
+
+        # Panning everything out of view removes all the items, but leaves
+        #  the display graph alone
+        xy = dict((n, self.a._node_xy(n)) for n in self.a.dispG)
+        self.a._pan(100000, 0)
+        self.assertEqual(self.a.find_all(), ())
+        self.check_subgraph()
+        self.check_num_nodes_edges(6, 8)
+        for n, (x, y) in xy.items():
+            self.assertEqual(self.a._node_xy(n), (x+100000, y))
+
+        # Panning back draws them again, marks and all
+        node = self.a._find_disp_node('a')
+        self.a.mark_node(node)
+        self.a._pan(-100000, 0)
+        token = self.a.dispG.nodes[node]['token']
+        self.assertTrue(token.is_visible)
+        self.assertTrue(token.is_marked)
+        self.assertEqual(self.a.itemcget(token.tag, 'fill'), 'yellow')
+        for u, v, d in self.a.dispG.edges(data=True):
+            if self.a.dispG.nodes[u]['token'].is_visible:
+                self.assertIsNot(d['token'].id, None)
+                self.assertIn(d['token'].id, self.a._edge_tokens)
+
+    def test_culling_edges(self):
+        def check_edges():
+            # Exactly the edges crossing the view are drawn
+            x0, y0, x1, y1 = self.a._view_region()
+            for u, v, d in self.a.dispG.edges(data=True):
+                (ux, uy), (vx, vy) = self.a._node_xy(u), self.a._node_xy(v)
+                in_view = (min(ux, vx) <= x1 and max(ux, vx) >= x0 and
+                           min(uy, vy) <= y1 and max(uy, vy) >= y0)
+                self.assertEqual(d['token'].id is not None, in_view)
+
+        self.display_a()
+        check_edges()
+
+        # Drag one node out of view, then pan so only it is in view
+        out = self.a._find_disp_node('out')
+        self.a._pending_moves[out] = (5000, 0)
+        self.a._schedule_redraw()
+        self.a._flush_redraw()
+        check_edges()
+        self.a._pan(-5000, 0)
+        check_edges()
+
+        self.a.hide_node(self.a._find_disp_node(2))
+        self.a._pan(5000, 0)
+        check_edges()
+        self.a.undo()
+        check_edges()
+
 class TestGraphCanvasMultiGraph(TestGraphCanvas):
     def setUp(self):
         super(TestGraphCanvasMultiGraph, self).setUp()
@@ -555,6 +1577,32 @@ class TestGraphCanvasMultiGraph(TestGraphCanvas):
         return super(TestGraphCanvasMultiGraph,
                 self).check_num_nodes_edges(number_of_nodes, number_of_edges)
 
+    def test_session_edge_keys(self):
+        import os
+        import tempfile
+
+        # Edge keys needn't be integers
+        self.a.dataG.add_edge('a', 'c', key='road')
+        self.display_a()
+        a = self.a._find_disp_node('a')
+        c = self.a._find_disp_node('c')
+        self.a.mark_edge(a, c, 'road')
+
+        fd, path = tempfile.mkstemp(suffix='.nxs')
+        os.close(fd)
+        try:
+            self.a.save_session(path)
+            self.a.clear()
+            self.a.open_session(path)
+        finally:
+            os.remove(path)
+
+        a = self.a._find_disp_node('a')
+        c = self.a._find_disp_node('c')
+        self.assertEqual(set(self.a.dispG[a][c]), set([0, 1, 'road']))
+        self.assertTrue(self.a.dispG[a][c]['road']['token'].is_marked)
+        self.assertFalse(self.a.dispG[a][c][0]['token'].is_marked)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,13 +7,24 @@ except ImportError:
 
 class NodeToken(tk.Canvas):
     def __init__(self, host_canvas, data, node_name):
-        tk.Canvas.__init__(self, width=20, height=20, highlightthickness=0)
-
         self._host_canvas = host_canvas
         self._complete = True
         self._marked = False
         self._default_bg = None
 
+        self._create()
+
+        # Draw myself
+        self.render(data, node_name)
+
+        # Copy of the data we were last rendered with (see refresh)
+        self._rendered_data = dict(data)
+
+    def _create(self):
+        """Create the widget the token is drawn on.  See ItemTokenMixin for
+        drawing on the host canvas instead."""
+        tk.Canvas.__init__(self, width=20, height=20, highlightthickness=0)
+
         self.bind('<ButtonPress-1>', self._host_event('onNodeButtonPress'))
         self.bind('<ButtonRelease-1>', self._host_event('onNodeButtonRelease'))
         self.bind('<B1-Motion>', self._host_event('onNodeMotion'))
@@ -24,13 +35,26 @@ class NodeToken(tk.Canvas):
         self.bind('<Enter>', lambda e: self.focus_set())
         self.bind('<Leave>', lambda e: self.master.focus())
 
-        # Draw myself
-        self.render(data, node_name)
-
     def render(self, data, node_name):
-        """Draw on canvas what we want node to look like"""
-        self.create_oval(5,5,15,15, fill='red',outline='black')
+        """Draw on canvas what we want node to look like.  Called again by
+        refresh when data changes, so it should update the items it drew the
+        first time rather than draw new ones."""
+        if not self._has_item(getattr(self, '_oval', None)):
+            self._oval = self.create_oval(5,5,15,15, fill='red',outline='black')
+
+    def refresh(self, data, node_name):
+        """Called by the host canvas's refresh with the node's current data.
+        Re-renders if data differs from what we were last rendered with.
+        Returns True if it did."""
+        if data == self._rendered_data:
+            return False
+        self.render(data, node_name)
+        self._rendered_data = dict(data)
+        return True
 
+    def _has_item(self, item):
+        """Returns True if item (an id returned by create_*) is still drawn"""
+        return item is not None and bool(self.type(item))
 
     def mark(self):
         """Mark the token just so it's easy for the user to pick out"""
@@ -102,6 +126,285 @@ class NodeToken(tk.Canvas):
             self._marked = False    # Have to undo what we did in for loop above
             self.mark()
 
+class ItemTokenMixin(object):
+    """Mix in ahead of a NodeToken class to draw the token as plain items on
+    the host canvas, grouped by a tag, rather than as a tk.Canvas widget of
+    its own.  Items are much cheaper than widgets when there are thousands
+    of nodes.  Use item_token_class to make such a class.
+
+    The canvas methods a token's render and mark use (create_*, coords,
+    bbox, itemconfig, delete, config and cget of width, height and
+    background) are emulated in the token's own coordinates, so tokens
+    written for NodeToken work unchanged.  The host canvas handles the
+    token's events.
+
+    On a virtual host canvas (see GraphCanvas), tokens start out undrawn;
+    the host calls show and hide as they move in and out of view.  render,
+    mark and mark_complete/mark_incomplete calls made while hidden are
+    remembered and applied when the token is next shown."""
+
+    # Token class this class was made from by item_token_class
+    _token_class = None
+
+    def _create(self):
+        host = self._host_canvas
+        self._width = 20
+        self._height = 20
+        self._background = ''
+        self._data = None
+        self._node_name = None
+
+        if getattr(host, 'virtual', False):
+            # Our id is handed out by the host, since the items (and their
+            #  ids) come and go as we scroll in and out of view
+            self.id = host._new_node_id()
+            self.tag = 'node:%d' % self.id
+            self._rect = None
+            self._visible = False
+            self._origin = None
+            return
+
+        # The background rectangle is created first so it is below all the
+        #  other items.  Its id identifies the token on the host canvas.
+        self._rect = host.create_rectangle(-10, -10, 10, 10, fill='',
+                                           outline='', width=0)
+        self.id = self._rect
+        self.tag = 'node:%d' % self.id
+        host.itemconfig(self.id, tags=('node', self.tag))
+        self._visible = True
+
+        # The token is drawn centered on (0, 0), so we know where it is
+        #  until the host canvas moves it into place
+        self._origin = (-10, -10)
+
+    def __init__(self, *args, **kwargs):
+        super(ItemTokenMixin, self).__init__(*args, **kwargs)
+        # From now on, the host canvas may move us around
+        self._origin = None
+
+    def render(self, data, node_name):
+        # Remember what to draw, for when we are shown
+        self._data = data
+        self._node_name = node_name
+        if self._visible:
+            super(ItemTokenMixin, self).render(data, node_name)
+
+    def mark_complete(self):
+        if self._visible:
+            super(ItemTokenMixin, self).mark_complete()
+        else:
+            self._complete = True
+
+    def mark_incomplete(self):
+        if self._visible:
+            super(ItemTokenMixin, self).mark_incomplete()
+        else:
+            self._complete = False
+
+    def show(self, x, y):
+        """Draw the token centered on x, y of the host canvas, if it isn't
+        drawn already"""
+        if self._visible:
+            return
+        x0 = x - self._width/2.0
+        y0 = y - self._height/2.0
+        self._rect = self._host_canvas.create_rectangle(
+            x0, y0, x0+self._width, y0+self._height, fill=self._background,
+            outline='', width=0, tags=('node', self.tag))
+        self._visible = True
+
+        self._origin = (x0, y0)
+        try:
+            if self._data is not None:
+                super(ItemTokenMixin, self).render(self._data,
+                                                   self._node_name)
+            if self._complete:
+                super(ItemTokenMixin, self).mark_complete()
+            else:
+                super(ItemTokenMixin, self).mark_incomplete()
+        finally:
+            self._origin = None
+
+    def hide(self):
+        """Remove the token's items from the host canvas, keeping its state
+        so it can be shown again"""
+        if not self._visible:
+            return
+        self._host_canvas.delete(self.tag)
+        self._rect = None
+        self._visible = False
+
+    @property
+    def is_visible(self):
+        """Returns True if the token is drawn on the host canvas"""
+        return self._visible
+
+    def _get_origin(self):
+        """Host canvas coordinates of our top left corner"""
+        if self._origin is not None:
+            return self._origin
+        # The host canvas keeps track of where our center is
+        x, y = self._host_canvas._node_xy(self.id)
+        return (x - self._width/2.0, y - self._height/2.0)
+
+    def _to_host(self, coords):
+        x0, y0 = self._get_origin()
+        coords = _flat_coords(coords)
+        return [c + (y0 if i % 2 else x0) for i, c in enumerate(coords)]
+
+    def _from_host(self, coords):
+        x0, y0 = self._get_origin()
+        return [c - (y0 if i % 2 else x0) for i, c in enumerate(coords)]
+
+    def _create_item(self, kind, args, kw):
+        tags = kw.get('tags', ())
+        if isinstance(tags, str):
+            tags = tags.split()
+        kw['tags'] = tuple(tags) + ('node', self.tag)
+        create = getattr(self._host_canvas, 'create_' + kind)
+        return create(*self._to_host(args), **kw)
+
+    def create_arc(self, *args, **kw):
+        return self._create_item('arc', args, kw)
+
+    def create_bitmap(self, *args, **kw):
+        return self._create_item('bitmap', args, kw)
+
+    def create_image(self, *args, **kw):
+        return self._create_item('image', args, kw)
+
+    def create_line(self, *args, **kw):
+        return self._create_item('line', args, kw)
+
+    def create_oval(self, *args, **kw):
+        return self._create_item('oval', args, kw)
+
+    def create_polygon(self, *args, **kw):
+        return self._create_item('polygon', args, kw)
+
+    def create_rectangle(self, *args, **kw):
+        return self._create_item('rectangle', args, kw)
+
+    def create_text(self, *args, **kw):
+        return self._create_item('text', args, kw)
+
+    def coords(self, item, *args):
+        if args:
+            return self._host_canvas.coords(item, *self._to_host(args))
+        return self._from_host(self._host_canvas.coords(item))
+
+    def bbox(self, *items):
+        b = self._host_canvas.bbox(*items)
+        if b is None:
+            return None
+        return self._from_host(b)
+
+    def itemconfig(self, item, cnf=None, **kw):
+        return self._host_canvas.itemconfig(item, cnf, **kw)
+    itemconfigure = itemconfig
+
+    def itemcget(self, item, option):
+        return self._host_canvas.itemcget(item, option)
+
+    def type(self, item):
+        return self._host_canvas.type(item)
+
+    def move(self, item, dx, dy):
+        self._host_canvas.move(item, dx, dy)
+
+    def delete(self, *items):
+        self._host_canvas.delete(*items)
+
+    def config(self, cnf=None, **kw):
+        """Emulates the width, height and background options of the
+        token's canvas; others are ignored"""
+        if cnf:
+            kw.update(cnf)
+        host = self._host_canvas
+        bg = kw.get('background', kw.get('bg'))
+        if bg is not None:
+            self._background = bg
+            if self._visible:
+                host.itemconfig(self._rect, fill=bg)
+        width = float(kw.get('width', self._width))
+        height = float(kw.get('height', self._height))
+        if (width, height) != (self._width, self._height) and \
+                not self._visible:
+            # Takes effect when we are shown
+            self._width = width
+            self._height = height
+        elif (width, height) != (self._width, self._height):
+            # Grow about our center, like a window item anchored at its
+            #  center does
+            x0, y0 = self._get_origin()
+            dx = (self._width - width)/2.0
+            dy = (self._height - height)/2.0
+            host.move(self.tag, dx, dy)
+            x0 += dx
+            y0 += dy
+            host.coords(self._rect, x0, y0, x0+width, y0+height)
+            if self._origin is not None:
+                self._origin = (x0, y0)
+            self._width = width
+            self._height = height
+    configure = config
+
+    def cget(self, key):
+        if key in ('background', 'bg'):
+            return self._background
+        if key == 'width':
+            return self._width
+        if key == 'height':
+            return self._height
+        raise KeyError(key)
+    __getitem__ = cget
+
+    def winfo_width(self):
+        return int(self._width)
+
+    def winfo_height(self):
+        return int(self._height)
+
+    def destroy(self):
+        self.hide()
+
+    def __str__(self):
+        return self.tag
+
+    def __reduce__(self):
+        # Classes made by item_token_class can't be found by name, so pickle
+        #  as the class we were made from
+        return (_new_item_token, (self._token_class or type(self),),
+                self.__getstate__())
+
+_item_token_classes = {}
+
+def item_token_class(token_class):
+    """Return a version of NodeToken subclass token_class which draws as
+    plain items on the host canvas (see ItemTokenMixin)"""
+    if issubclass(token_class, ItemTokenMixin):
+        return token_class
+    if token_class not in _item_token_classes:
+        _item_token_classes[token_class] = type(
+            'Item' + token_class.__name__, (ItemTokenMixin, token_class),
+            {'_token_class': token_class})
+    return _item_token_classes[token_class]
+
+def _new_item_token(token_class):
+    """Unpickle an item token (see ItemTokenMixin.__reduce__)"""
+    cls = item_token_class(token_class)
+    return cls.__new__(cls)
+
+def _flat_coords(coords):
+    """Flatten coordinates passed as x1, y1, ... or as (x1, y1), ..."""
+    ans = []
+    for c in coords:
+        if isinstance(c, (list, tuple)):
+            ans.extend(_flat_coords(c))
+        else:
+            ans.append(c)
+    return ans
+
 class EdgeToken(object):
     def __init__(self, edge_data):
         """This object mimics a token for the edges.  All of this class's
@@ -112,6 +415,9 @@ class EdgeToken(object):
         self._spline_id = None
         self._host_canvas = None
 
+        # Copy of the data the spline was last configured from (see refresh)
+        self._rendered_data = None
+
     def render(self, host_canvas, coords, cfg=None, directed=False):
         """Called whenever canvas is about to draw an edge.
         The host_canvas will be the GraphCanvas object.
@@ -121,6 +427,12 @@ class EdgeToken(object):
             - xa,ya -- Position of the midpoint of spline
             - x2,y2 -- Position of the end of teh spline
         """
+        cfg = self.line_cfg(cfg, directed)
+        self._drawn(host_canvas, host_canvas.create_line(*coords, **cfg))
+
+    def line_cfg(self, cfg=None, directed=False):
+        """Options render passes to create_line: cfg (by default, from
+        render_cfg) plus the options every edge must have"""
         if cfg is None:
             cfg = self.render_cfg()
         # Amend config options to include options which must be included
@@ -130,25 +442,53 @@ class EdgeToken(object):
             # Add arrow
             cfg['arrow'] = tk.LAST
             cfg['arrowshape'] = (30,40,5)
-        self._spline_id = host_canvas.create_line(*coords, **cfg)
+        return cfg
+
+    def _drawn(self, host_canvas, spline_id):
+        """Record that our spline is item spline_id of host_canvas.  Called
+        by render, or by the host canvas if it drew the spline itself."""
+        self._spline_id = spline_id
         self._host_canvas = host_canvas
+        self._rendered_data = dict(self.edge_data or {})
+
+    def refresh(self, edge_data):
+        """Called by the host canvas's refresh with the edge's current data.
+        Reconfigures the spline if edge_data differs from what it was last
+        configured from.  Returns True if it did."""
+        self.edge_data = edge_data
+        if self._spline_id is None or edge_data == self._rendered_data:
+            # Not drawn (it'll be drawn from edge_data when it is), or
+            #  nothing's changed
+            return False
+        self.itemconfig()
+        return True
 
     def itemconfig(self, cfg=None):
         """Update item config for underlying spline.  If cfg is none,
         auto-regenerate cfg from render_cfg method"""
         if cfg is None:
             cfg = self.render_cfg()
+            if self._spline_id is not None:
+                self._rendered_data = dict(self.edge_data or {})
+        if self._spline_id is None:
+            # Not on the canvas (a virtual canvas only draws edges in view)
+            return
         assert self._host_canvas is not None, "Must draw using render method first"
         self._host_canvas.itemconfig(self._spline_id, cfg)
 
     def coords(self, coords):
         """Update coordinates for spline."""
+        if self._spline_id is None:
+            return
         assert self._host_canvas is not None, "Must draw using render method first"
         return self._host_canvas.coords(self._spline_id, coords)
 
     def delete(self):
         """Remove spline from canvas"""
+        if self._spline_id is None:
+            return
         self._host_canvas.delete(self._spline_id)
+        self._spline_id = None
 
     def render_cfg(self):
         """Creates  config dict used by host canvas's create_line
@@ -208,6 +548,8 @@ class TkPassthroughNodeToken(NodeToken):
     def __init__(self, *args, **kwargs):
         self._default_label_color = 'black'
         self._default_outline_color = 'black'
+        self.label = None
+        self.marker = None
 
         NodeToken.__init__(self, *args, **kwargs)
 
@@ -216,26 +558,32 @@ class TkPassthroughNodeToken(NodeToken):
         """Draw on canvas what we want node to look like.  If data contains
         keys that can configure a tk.Canvas oval, it will do so.  If data
         contains keys that start with "label_" and can configure a text
-        object, it will configure the text."""
-
-        # Take a first cut at creating the marker and label
-        self.label = self.create_text(0, 0, text=node_name)
-        self.marker = self.create_oval(0, 0, 10, 10,
-                                       fill='red',outline='black')
+        object, it will configure the text.  The text is tagged 'label' so
+        the host canvas can hide it when zoomed out.
+
+        Rendering again (see refresh) reconfigures the same marker and label."""
+
+        if not self._has_item(self.label):
+            # Take a first cut at creating the marker and label, and remember
+            #  how they look before data has configured them
+            self.label = self.create_text(0, 0, text=node_name, tags='label')
+            self.marker = self.create_oval(0, 0, 10, 10,
+                                           fill='red',outline='black')
+            self._marker_base = dict((k, v[-1]) for k, v in
+                                     self.itemconfig(self.marker).items())
+            self._label_base = dict((k, v[-1]) for k, v in
+                                    self.itemconfig(self.label).items())
 
         # Modify marker using options from data
-        cfg = self.itemconfig(self.marker)
-        for k,v in cfg.copy().items():
-            cfg[k] = data.get(k, cfg[k][-1])
+        cfg = dict((k, data.get(k, v)) for k, v in self._marker_base.items())
         self.itemconfig(self.marker, **cfg)
-        self._default_outline_color = data.get('outline',self._default_outline_color)
+        self._default_outline_color = cfg['outline']
 
         # Modify the text label using options from data
-        cfg = self.itemconfig(self.label)
-        for k,v in cfg.copy().items():
-            cfg[k] = data.get('label_'+k, cfg[k][-1])
+        cfg = dict((k, data.get('label_'+k, v))
+                   for k, v in self._label_base.items())
         self.itemconfig(self.label, **cfg)
-        self._default_label_color = data.get('label_fill',self._default_label_color)
+        self._default_label_color = cfg['fill']
 
         # Figure out how big we really need to be
         bbox = self.bbox(self.label)
@@ -0,0 +1,99 @@
+"""
+Stack of saved visualizations (see GraphCanvas.dump_visualization) for undo
+and redo, with a cap on how much memory it takes.
+"""
+import collections
+import tempfile
+import zlib
+
+
+class UndoHistory(object):
+    """Stack of states (bytes, as returned by dump_visualization).  Only
+    the newest max_entries states, and no more than max_bytes of them, are
+    kept in memory.  Older states are compressed and spilled to a temporary
+    file, and read back only if they're popped.
+
+    Typical use:
+        >>> history = UndoHistory(max_entries=50, max_bytes=64*2**20)
+        >>> history.push(canvas.dump_visualization())
+        >>> canvas.load_visualization(history.pop())
+    """
+
+    def __init__(self, max_entries=50, max_bytes=64*2**20, compress_level=6):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+
+        # Newest states, oldest first
+        self._states = collections.deque()
+        self._bytes = 0
+
+        # Spill file, and (offset, length) of each state in it, oldest first
+        self._file = None
+        self._spilled = []
+
+    def push(self, state):
+        """Add state to the top of the stack"""
+        self._states.append(state)
+        self._bytes += len(state)
+
+        # Always keep the newest state in memory, so a single undo is quick
+        while len(self._states) > 1 and (
+                len(self._states) > self.max_entries or
+                self._bytes > self.max_bytes):
+            self._spill(self._states.popleft())
+
+    def pop(self):
+        """Remove and return the state on top of the stack.  Raises
+        IndexError if it's empty."""
+        if self._states:
+            state = self._states.pop()
+            self._bytes -= len(state)
+            return state
+        if not self._spilled:
+            raise IndexError('pop from empty UndoHistory')
+
+        offset, length = self._spilled.pop()
+        self._file.seek(offset)
+        state = zlib.decompress(self._file.read(length))
+        self._file.truncate(offset)
+        return state
+
+    def clear(self):
+        self._states.clear()
+        self._bytes = 0
+        del self._spilled[:]
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _spill(self, state):
+        self._bytes -= len(state)
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='networkx_viewer_undo')
+        data = zlib.compress(state, self.compress_level)
+        self._file.seek(0, 2)
+        self._spilled.append((self._file.tell(), len(data)))
+        self._file.write(data)
+
+    @property
+    def memory_usage(self):
+        """Bytes of states held in memory"""
+        return self._bytes
+
+    @property
+    def disk_usage(self):
+        """Bytes of (compressed) states spilled to disk"""
+        return sum(length for offset, length in self._spilled)
+
+    @property
+    def spilled(self):
+        """Number of states spilled to disk"""
+        return len(self._spilled)
+
+    def __len__(self):
+        return len(self._states) + len(self._spilled)
+
+    def __bool__(self):
+        return len(self) > 0
+    __nonzero__ = __bool__
@@ -3,11 +3,13 @@ try:
     import tkinter as tk
     import tkinter.messagebox as tkm
     import tkinter.simpledialog as tkd
+    import tkinter.filedialog as tkf
 except ImportError:
     # Python 2
     import Tkinter as tk
     import tkMessageBox as tkm
     import tkSimpleDialog as tkd
+    import tkFileDialog as tkf
 
 
 
@@ -118,6 +120,11 @@ class ViewerApp(tk.Tk):
         self.menubar = tk.Menu(self)
         self.config(menu=self.menubar)
 
+        file = tk.Menu(self.menubar, tearoff=0)
+        file.add_command(label='Open Session...', command=self.open_session)
+        file.add_command(label='Save Session...', command=self.save_session)
+        self.menubar.add_cascade(label='File', menu=file)
+
         view = tk.Menu(self.menubar, tearoff=0)
         view.add_command(label='Undo', command=self.canvas.undo, accelerator="Ctrl+Z")
         self.bind_all("<Control-z>", lambda e: self.canvas.undo())  # Implement accelerator
@@ -128,6 +135,9 @@ class ViewerApp(tk.Tk):
         view.add_command(label='Reset Node Marks', command=self.reset_node_markings)
         view.add_command(label='Reset Edge Marks', command=self.reset_edge_markings)
         view.add_command(label='Redraw Plot', command=self.canvas.replot)
+        view.add_command(label='Stop Drawing', command=self.stop_drawing,
+                         accelerator="Esc")
+        self.bind_all("<Escape>", lambda e: self.stop_drawing())
         view.add_separator()
         view.add_command(label='Grow display one level...', command=self.grow_all)
 
@@ -138,6 +148,37 @@ class ViewerApp(tk.Tk):
         if node is None: return
         self.canvas.center_on_node(node)
 
+    _session_filetypes = [('Sessions', '*.nxs'), ('All files', '*')]
+
+    def save_session(self, path=None):
+        """Save the display to path (asking for one if not given).  See
+        GraphCanvas.save_session."""
+        if path is None:
+            path = tkf.asksaveasfilename(parent=self,
+                                         defaultextension='.nxs',
+                                         filetypes=self._session_filetypes)
+            if not path:
+                return
+        self.canvas.save_session(path)
+
+    def open_session(self, path=None):
+        """Display the session saved to path (asking for one if not
+        given).  See GraphCanvas.open_session."""
+        if path is None:
+            path = tkf.askopenfilename(parent=self,
+                                       filetypes=self._session_filetypes)
+            if not path:
+                return
+        try:
+            self.canvas.open_session(path)
+        except (IOError, OSError, ValueError) as e:
+            tkm.showerror("Can't open session", str(e))
+
+    def stop_drawing(self):
+        """Stop any progressive plot or background layout in progress"""
+        self.canvas.cancel_render()
+        self.canvas.cancel_layout()
+
     def reset_edge_markings(self):
         for u,v,k,d in self.canvas.dispG.edges(data=True, keys=True):
             token = d['token']
@@ -204,9 +245,10 @@ class ViewerApp(tk.Tk):
 
     def grow_all(self):
         """Grow all visible nodes one level"""
-        for u, d in self.canvas.dispG.copy().nodes.items():
-            if not d['token'].is_complete:
-                self.canvas.grow_node(u)
+        with self.canvas.batch():
+            for u, d in self.canvas.dispG.copy().nodes.items():
+                if not d['token'].is_complete:
+                    self.canvas.grow_node(u)
 
     def get_node_list(self):
         """Get nodes in the node list and clear"""